@@ -26,6 +26,7 @@
      * `$ python StreamCat.py -c /abs/path/alt.csv`
 """
 import os
+import re
 
 import click
 import geopandas as gpd
@@ -40,22 +41,30 @@ from stream_cat_config import (
     MASK_DIR_SLP10,
     MASK_DIR_SLP20,
     ACCUM_DIR,
+    ACCUM_ENGINE,
     NHD_DIR,
     OUT_DIR,
     PCT_FULL_FILE,
     PCT_FULL_FILE_RP100,
+    POINT_ASSIGN,
     USER_ZONES,
+    ZONAL_ENGINE,
 )
 from StreamCat_functions import (
-    Accumulation,
     AdjustCOMs,
+    ConnectorStore,
     PointInPoly,
-    appendConnectors,
+    ZonalCache,
+    accumulateZone,
     createCatStats,
-    interVPU,
+    load_zone_runs,
+    metric_edges,
     makeNumpyVectors,
     mask_points,
     nhd_dict,
+    scheduleZones,
+    stashZonal,
+    zoneDependencies,
 )
 
 # Load table of layers to be run...
@@ -76,24 +85,99 @@ if not os.path.exists(ACCUM_DIR):
 
 INPUTS = np.load(ACCUM_DIR +"/vpu_inputs.npy", allow_pickle=True).item()
 
+mask_dirs = {1: MASK_DIR_RP100, 2: MASK_DIR_SLP10, 3: MASK_DIR_SLP20}
+
+
+def layer_path(lyr):
+    # use abspath
+    return lyr if "/" in lyr or "\\" in lyr else f"{LYR_DIR}/{lyr}"
+
+
+def row_percentiles(row):
+    # optional `percentiles` column of the control table, i.e. "10;50;90",
+    # only Continuous layers summarized by catchment carry the histograms
+    pct = row.get("percentiles")
+    if row.accum_type != "Continuous" or row.by_RPU != 0 or pd.isna(pct):
+        return []
+    return [float(q) for q in str(pct).split(";")]
+
+
+def row_weight(row):
+    # optional `weight` column of the control table, "<name>=<source>" where
+    # source is a weight raster or "<table>:<FIELD>" of weights by COMID
+    # under the VPU directory, i.e. SlpWtd=NHDPlusAttributes/elevslope.dbf:SLOPE
+    weight = row.get("weight")
+    if pd.isna(weight):
+        return None
+    name, source = str(weight).split("=", 1)
+    if not re.search(r"\.(dbf|csv):\w+$", source):
+        source = layer_path(source)
+    return name, source
+
+
+if ZONAL_ENGINE == "native":
+    # every raster layer, masked or not, gets its statistics from one pass
+    # over each zone's catchment grid, createCatStats picks the tables up
+    # from the zonal cache
+    cache = ZonalCache(f"{OUT_DIR}/DBF_stash/zonal_cache")
+    rows = [
+        row
+        for _, row in ctl.query("run == 1 and by_RPU == 0").iterrows()
+        if row.accum_type in ("Continuous", "Categorical")
+    ]
+    if rows:
+        print(
+            f"Stashing zonal statistics of {', '.join(r.FullTableName for r in rows)}...",
+            end="",
+            flush=True,
+        )
+    for zone, hydroregion in INPUTS.items():
+        layers = []
+        for r in rows:
+            if os.path.exists(f"{OUT_DIR}/{r.FullTableName}_{zone}.csv"):
+                continue
+            mask = (
+                f"{mask_dirs[r.use_mask]}/{zone}.tif" if r.use_mask in mask_dirs else None
+            )
+            layers.append((layer_path(r.LandscapeLayer), r.accum_type, mask))
+            if row_percentiles(r):
+                path = layer_path(r.LandscapeLayer)
+                edges = metric_edges(OUT_DIR, r.FullTableName, path)
+                layers.append((path, "Histogram", mask, tuple(edges)))
+            weight = row_weight(r)
+            if weight and not re.search(r"\.(dbf|csv):\w+$", weight[1]):
+                layers.append(
+                    (layer_path(r.LandscapeLayer), "Weighted", mask, weight[1])
+                )
+        if layers:
+            print(zone, end=", ", flush=True)
+            # the catchment grid is decoded once into runs in ACCUM_DIR
+            zone_runs = load_zone_runs(
+                zone,
+                f"{NHD_DIR}/NHDPlus{hydroregion}/NHDPlus{zone}/NHDPlusCatchment/cat",
+                ACCUM_DIR,
+            )
+            stashZonal(zone_runs, layers, cache)
+    if rows:
+        print("done!")
+
 already_processed = []
+queued = []
+sketches = {}
+weights = {}
 
 for _, row in ctl.query("run == 1").iterrows():
 
     apm = "" if row.AppendMetric == "none" else row.AppendMetric
-    if row.use_mask == 1:
-        mask_dir = MASK_DIR_RP100
-    elif row.use_mask == 2:
-        mask_dir = MASK_DIR_SLP10
-    elif row.use_mask == 3:
-        mask_dir = MASK_DIR_SLP20
-    else:
-        mask_dir = ""
-    layer = (
-        row.LandscapeLayer
-        if "/" in row.LandscapeLayer or "\\" in row.LandscapeLayer
-        else (f"{LYR_DIR}/{row.LandscapeLayer}")
-    )  # use abspath
+    mask_dir = mask_dirs.get(row.use_mask, "")
+    layer = layer_path(row.LandscapeLayer)
+    percentiles = row_percentiles(row)
+    edges = None
+    if percentiles:
+        edges = metric_edges(OUT_DIR, row.FullTableName, layer)
+        sketches[row.FullTableName] = percentiles
+    if row_weight(row):
+        weights[row.FullTableName] = row_weight(row)[0]
     if isinstance(row.summaryfield, str):
         summary = row.summaryfield.split(";")
     else:
@@ -107,8 +191,6 @@ for _, row in ctl.query("run == 1").iterrows():
         points = gpd.read_file(layer)
         if mask_dir:
             points = mask_points(points, mask_dir, INPUTS)
-    # File string to store InterVPUs needed for adjustments
-    Connector = f"{OUT_DIR}/{row.FullTableName}_connectors.csv"
     print(
         f"Acquiring `{row.FullTableName}` catchment statistics...",
         end="",
@@ -121,7 +203,7 @@ for _, row in ctl.query("run == 1").iterrows():
             if not row.accum_type == "Point":
                 izd = (
                     f"{mask_dir}/{zone}.tif"
-                    if mask_dir
+                    if mask_dir and ZONAL_ENGINE == "arcpy"
                     else f"{pre}/NHDPlusCatchment/cat"
                 )
                 cat = createCatStats(
@@ -135,61 +217,78 @@ for _, row in ctl.query("run == 1").iterrows():
                     NHD_DIR,
                     hydroregion,
                     apm,
+                    engine=ZONAL_ENGINE,
+                    sketch=bool(percentiles),
+                    weight=row_weight(row),
+                    edges=edges,
                 )
             if row.accum_type == "Point":
                 izd = f"{pre}/NHDPlusCatchment/Catchment.shp"
                 cat = PointInPoly(
-                    points, zone, izd, pct_full, mask_dir, apm, summary
+                    points,
+                    zone,
+                    izd,
+                    pct_full,
+                    mask_dir,
+                    apm,
+                    summary,
+                    cache_dir=f"{OUT_DIR}/DBF_stash/catchments",
+                    assign=POINT_ASSIGN,
+                    accum_dir=ACCUM_DIR,
+                    cache=ZonalCache(f"{OUT_DIR}/DBF_stash/zonal_cache"),
                 )
             cat.to_csv(f"{OUT_DIR}/{row.FullTableName}_{zone}.csv", index=False)
     print("done!")
-    print("Accumulating...", end="", flush=True)
-    for zone in INPUTS:
-        fn = f"{OUT_DIR}/{row.FullTableName}_{zone}.csv"
-        cat = pd.read_csv(fn)
-        processed = cat.columns.str.extract(r"^(UpCat|Ws)").any().bool()
-        if processed:
-            print("skipping!")
-            already_processed.append(row.FullTableName)
-            break
-        print(zone, end=", ", flush=True)
-
-        if zone in inter_vpu.ToZone.values:
-            cat = appendConnectors(cat, Connector, zone, inter_vpu)
-        accum = np.load(f"accum_npy/accum_{zone}.npz")
-
-        cat.COMID = cat.COMID.astype(accum["comids"].dtype)
-        cat.set_index("COMID", inplace=True)
-        cat = cat.loc[accum["comids"]].reset_index().copy()
-
-        up = Accumulation(
-            cat, accum["comids"], accum["lengths"], accum["upstream"], "Up"
-        )
-
-        ws = Accumulation(
-            cat, accum["comids"], accum["lengths"], accum["upstream"], "Ws"
-        )
+    # skip tables that have already been accumulated in any zone, a stopped
+    # run leaves some zones accumulated and they must not be accumulated twice
+    processed = any(
+        pd.read_csv(f"{OUT_DIR}/{row.FullTableName}_{zone}.csv", nrows=0)
+        .columns.str.contains(r"^(UpCat|Ws)")
+        .any()
+        for zone in INPUTS
+    )
+    if processed:
+        already_processed.append(row.FullTableName)
+    else:
+        queued.append((row.FullTableName, row.accum_type))
 
-        if zone in inter_vpu.ToZone.values:
-            cat = pd.read_csv(f"{OUT_DIR}/{row.FullTableName}_{zone}.csv")
-        if zone in inter_vpu.FromZone.values:
-            interVPU(
-                ws,
-                cat.columns[1:],
-                row.accum_type,
-                zone,
-                Connector,
-                inter_vpu.copy(),
-            )
-        upFinal = pd.merge(up, ws, on="COMID")
-        final = pd.merge(cat, upFinal, on="COMID")
-        final.to_csv(f"{OUT_DIR}/{row.FullTableName}_{zone}.csv", index=False)
-    print(end="") if processed else print("done!")
-    if already_processed:
-        print(
-            "\n!!!Processing Problem!!!\n\n"
-            f"{', '.join(already_processed)} already run!\n"
-            "Be sure to delete the associated files in your `OUTDIR` to rerun:"
-            f"\n\t> {OUT_DIR}\n\n!!! `$OUT_DIR/DBF_stash/*` "
-            f"output used in 'Continuous' and 'Categorical' metrics!!!"
-        )
+if queued:
+    # zone-major so each zone's topology is loaded once for every metric,
+    # zones run concurrently once the zones flowing into them are finished
+    print(
+        f"Accumulating {', '.join(name for name, _ in queued)}...",
+        end="",
+        flush=True,
+    )
+    # connectors from zones accumulated in earlier runs, i.e. USER_ZONES runs
+    # of a downstream zone
+    store = ConnectorStore.load(OUT_DIR, [name for name, _ in queued])
+    deps = zoneDependencies(inter_vpu, INPUTS)
+    for zone, passed in scheduleZones(
+        accumulateZone,
+        deps,
+        queued,
+        inter_vpu,
+        OUT_DIR,
+        zone_kwargs=lambda z: {
+            "connectors": store.for_zone(z, inter_vpu),
+            "sketches": sketches,
+            "weights": weights,
+            "engine": ACCUM_ENGINE,
+        },
+    ):
+        for name, tbl in passed.items():
+            store.update(name, tbl)
+        print(zone, end=", ", flush=True)
+    store.save(OUT_DIR)
+    print("done!")
+saved = ZonalCache(f"{OUT_DIR}/DBF_stash/zonal_cache").saved
+print(f"Zonal cache hits have saved {saved / 60:.1f} minutes of reads so far.")
+if already_processed:
+    print(
+        "\n!!!Processing Problem!!!\n\n"
+        f"{', '.join(already_processed)} already run!\n"
+        "Be sure to delete the associated files in your `OUTDIR` to rerun:"
+        f"\n\t> {OUT_DIR}\n\n!!! `$OUT_DIR/DBF_stash/*` "
+        f"output used in 'Continuous' and 'Categorical' metrics!!!"
+    )
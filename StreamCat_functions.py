@@ -17,19 +17,26 @@
  Date: October 2015
 """
 
+import hashlib
+import json
 import os
+import re
 import sys
+import threading
 import time
 from collections import OrderedDict, defaultdict, deque
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from pathlib import Path
-from typing import Generator
 
 import numpy as np
 import pandas as pd
 import rasterio
+from scipy import sparse
 #from gdalconst import *
-from osgeo import gdal, ogr, osr
+from osgeo import gdal, osr
 from rasterio import transform
+from rasterio.windows import Window
 
 if rasterio.__version__[0] == "0":
     from rasterio.warp import RESAMPLING, calculate_default_transform, reproject
@@ -38,17 +45,25 @@ if rasterio.__version__[0] == "1":
 
 import fiona
 import geopandas as gpd
-from geopandas.tools import sjoin
 
 os.environ["PATH"] += r";C:\Program Files\ArcGIS\Pro\bin"
 sys.path.append(r"C:\Program Files\ArcGIS\Pro\Resources\ArcPy")
-import arcpy
-from arcpy.sa import TabulateArea, ZonalStatisticsAsTable
+try:
+    import arcpy
+    from arcpy.sa import TabulateArea, ZonalStatisticsAsTable
+except ImportError:  # optional, createCatStats can run with engine="native"
+    arcpy = None
 
 ###
 # Speed up imports
 import pyogrio 
 from joblib import Parallel, delayed
+from joblib.externals.loky import get_reusable_executor
+
+try:
+    from numba import njit, prange, set_num_threads
+except ImportError:  # optional, Accumulation falls back to the numpy engines
+    njit = None
 
 ##############################################################################
 
@@ -60,6 +75,237 @@ class LicenseError(Exception):
 ##############################################################################
 
 
+class ConnectorStore:
+    """
+    Holds the inter-VPU connector rows of every metric in memory for a run,
+    keyed by metric and COMID. Zones add the watershed rows they pass
+    downstream with `update` and the zones they flow into take their rows
+    with `for_zone`, the store is written once at the end of the run with
+    `save`.
+
+    Arguments
+    ---------
+    tables          : dict of metric (FullTableName) to connector table indexed by COMID
+    """
+
+    def __init__(self, tables=None):
+        self.tables = dict(tables or {})
+
+    def update(self, metric, tbl):
+        # rows for a COMID that is already stored replace the old ones
+        old = self.tables.get(metric)
+        if old is not None:
+            tbl = pd.concat([old.loc[~old.index.isin(tbl.index)], tbl], axis=0)
+        self.tables[metric] = tbl
+
+    def for_zone(self, zone, interVPUtbl):
+        """
+        Returns the connector rows of every metric that flow into `zone`, the
+        thruCOMIDs and toCOMIDs listed for it as ToZone in the InterVPU table.
+        """
+        to_zone = interVPUtbl.loc[interVPUtbl.ToZone == zone]
+        comids = np.append(
+            to_zone.thruCOMIDs.values, to_zone.toCOMIDs.values[to_zone.toCOMIDs.values > 0]
+        )
+        return {
+            metric: tbl.loc[tbl.index.isin(comids)].reset_index()
+            for metric, tbl in self.tables.items()
+        }
+
+    def save(self, out_dir):
+        # write beside the target and swap in so a crash never leaves a partial file
+        for metric, tbl in self.tables.items():
+            path = f"{out_dir}/{metric}_connectors.parquet"
+            tbl.to_parquet(f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, out_dir, metrics):
+        tables = {}
+        for metric in metrics:
+            path = f"{out_dir}/{metric}_connectors.parquet"
+            if os.path.exists(path):
+                tables[metric] = pd.read_parquet(path)
+        return cls(tables)
+
+
+##############################################################################
+
+
+class ZonalCache:
+    """
+    Content-addressed store of zonal statistics tables. A table is keyed by
+    the fingerprint (path, size, mtime) of the landscape layer, zone grid and
+    mask it was computed from and its stat type, so a changed raster or mask
+    misses instead of returning stale results. Tables are written as Parquet
+    and the least recently used are evicted once the cache is over
+    `max_bytes`. The manifest also keeps the seconds of reading or computing
+    each table, summed over every hit in `saved`.
+
+    Arguments
+    ---------
+    cache_dir       : directory holding the tables and manifest.json
+    max_bytes       : size the cache is trimmed to after each `put`
+    """
+
+    def __init__(self, cache_dir, max_bytes=20 * 2**30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self.manifest = f"{cache_dir}/manifest.json"
+        self.entries, self.saved = {}, 0.0
+        if os.path.exists(self.manifest):
+            with open(self.manifest) as f:
+                state = json.load(f)
+            self.entries, self.saved = state["entries"], state["saved"]
+
+    def key(self, layer, zone_raster, mask=None, stat=None):
+        """
+        Returns the cache key of a table, layer and zone_raster may be (path,
+        band) tuples and zone_raster a `ZoneRuns`.
+        """
+        parts = []
+        for src in (layer, zone_raster, mask):
+            src = getattr(src, "name", src)
+            path, band = src if isinstance(src, tuple) else (src, 1)
+            parts.append(
+                None if path is None else (str(path), band, file_fingerprint(path))
+            )
+        parts.append(stat)
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        path = f"{self.cache_dir}/{key}.parquet"
+        if entry is None or not os.path.exists(path):
+            return None
+        table = pd.read_parquet(path)
+        entry["used"] = time.time()
+        self.saved += entry["seconds"]
+        self._write()
+        return table
+
+    def put(self, key, table, seconds=0.0, **info):
+        path = f"{self.cache_dir}/{key}.parquet"
+        table.to_parquet(f"{path}.tmp", index=False)
+        os.replace(f"{path}.tmp", path)
+        self.entries[key] = dict(
+            info, bytes=os.path.getsize(path), seconds=seconds, used=time.time()
+        )
+        total = sum(e["bytes"] for e in self.entries.values())
+        for old in sorted(self.entries, key=lambda k: self.entries[k]["used"]):
+            if total <= self.max_bytes or old == key:
+                break
+            total -= self.entries.pop(old)["bytes"]
+            if os.path.exists(f"{self.cache_dir}/{old}.parquet"):
+                os.remove(f"{self.cache_dir}/{old}.parquet")
+        self._write()
+
+    def _write(self):
+        with open(f"{self.manifest}.tmp", "w") as f:
+            json.dump({"entries": self.entries, "saved": self.saved}, f)
+        os.replace(f"{self.manifest}.tmp", self.manifest)
+
+
+##############################################################################
+
+
+class ZoneRuns:
+    """
+    Row-wise run-length index of a zone grid, one run per stretch of cells of
+    a row that share a gridcode, written once per zone by `save_zone_runs`.
+    Stands in for the opened zone raster in the zonal engines: `read` paints
+    a window back from the runs that cross it, which is much cheaper than
+    decoding the ESRI grid again for every metric.
+
+    Arguments
+    ---------
+    row             : row of each run, runs are sorted by row then column
+    col_start       : first column of each run
+    col_end         : column after the last of each run
+    gridcode        : zone code of each run
+    transform       : affine transform of the zone grid
+    shape           : (height, width) of the zone grid
+    name            : path of the zone raster the runs were built from
+    crs             : crs of the zone grid
+    """
+
+    nodata = -1
+
+    def __init__(
+        self, row, col_start, col_end, gridcode, transform, shape, name, crs=None
+    ):
+        self.row = row
+        self.col_start = col_start
+        self.col_end = col_end
+        self.gridcode = gridcode
+        self.transform = transform
+        self.height, self.width = shape
+        self.name = name
+        self.crs = crs
+
+    @property
+    def res(self):
+        return abs(self.transform.a), abs(self.transform.e)
+
+    def window_bounds(self, window):
+        return rasterio.windows.bounds(window, self.transform)
+
+    def read(self, band=1, window=None):
+        if window is None:
+            window = Window(0, 0, self.width, self.height)
+        r0, c0 = int(window.row_off), int(window.col_off)
+        h, w = int(window.height), int(window.width)
+        lo, hi = np.searchsorted(self.row, [r0, r0 + h])
+        cs = np.asarray(self.col_start[lo:hi])
+        ce = np.asarray(self.col_end[lo:hi])
+        keep = (ce > c0) & (cs < c0 + w)
+        cs = np.maximum(cs[keep], c0) - c0
+        ce = np.minimum(ce[keep], c0 + w) - c0
+        rows = np.asarray(self.row[lo:hi])[keep] - r0
+        lengths = ce - cs
+        # flat position of every cell of every run in the window
+        first = rows.astype(np.int64) * w + cs
+        starts = np.repeat(first - np.cumsum(lengths) + lengths, lengths)
+        block = np.full(h * w, self.nodata, dtype=np.int32)
+        block[starts + np.arange(lengths.sum())] = np.repeat(
+            np.asarray(self.gridcode[lo:hi])[keep], lengths
+        )
+        return block.reshape(h, w)
+
+    def sample(self, x, y):
+        """
+        Returns the zone code of the cell under each point, `nodata` off the
+        grid or outside of every zone. The run holding a cell is found with a
+        binary search over the runs of its row, run in lockstep for all points.
+        """
+        cols, rows = ~self.transform * (np.asarray(x, float), np.asarray(y, float))
+        rows, cols = np.floor(rows).astype(np.int64), np.floor(cols).astype(np.int64)
+        codes = np.full(len(rows), self.nodata, dtype=np.int32)
+        ongrid = np.flatnonzero(
+            (rows >= 0) & (rows < self.height) & (cols >= 0) & (cols < self.width)
+        )
+        rows, cols = rows[ongrid], cols[ongrid]
+        first = np.searchsorted(self.row, rows, side="left")
+        lo, hi = first.copy(), np.searchsorted(self.row, rows, side="right")
+        # first run of the row starting after the cell
+        active = np.flatnonzero(lo < hi)
+        while active.size:
+            mid = (lo[active] + hi[active]) // 2
+            after = np.asarray(self.col_start[mid]) > cols[active]
+            hi[active] = np.where(after, mid, hi[active])
+            lo[active] = np.where(after, lo[active], mid + 1)
+            active = active[lo[active] < hi[active]]
+        run = lo - 1
+        hit = run >= first
+        hit[hit] = np.asarray(self.col_end[run[hit]]) > cols[hit]
+        codes[ongrid[hit]] = self.gridcode[run[hit]]
+        return codes
+
+
+##############################################################################
+
+
 def UpcomDict(nhd, interVPUtbl, zone):
     """
     __author__ = "Marc Weber <weber.marc@epa.gov>"
@@ -212,49 +458,92 @@ def GetRasterValueAtPoints(rasterfile, shapefile, fieldname):
     shapefile         : a shapefile with full pathname and extension
     fieldname         : field name in the shapefile to identify values
     """
-    src_ds = gdal.Open(rasterfile)
-    no_data = src_ds.GetRasterBand(1).GetNoDataValue()
-    gt = src_ds.GetGeoTransform()
-    rb = src_ds.GetRasterBand(1)
-    df = pd.DataFrame(columns=(fieldname, "RasterVal"))
-    ds = ogr.Open(shapefile)
-    lyr = ds.GetLayer()
-    data = []
-    for feat in lyr:
-        geom = feat.GetGeometryRef()
-        name = feat.GetField(fieldname)
-        mx, my = geom.GetX(), geom.GetY()  # coord in map units
-
-        # Convert from map to pixel coordinates.
-        # Only works for geotransforms with no rotation.
-        px = int((mx - gt[0]) / gt[1])  # x pixel
-        py = int((my - gt[3]) / gt[5])  # y pixel
-
-        intval = rb.ReadAsArray(px, py, 1, 1)
-        if intval == no_data:
-            intval = -9999
-        data.append((name, float(intval)))
-
-    df = pd.DataFrame(data, columns=(fieldname, "RasterVal"))
+    points = gpd.read_file(shapefile)
+    values = sample_raster(
+        rasterfile, points.geometry.x.values, points.geometry.y.values, fill=-9999
+    ).astype(float)
+    with rasterio.open(rasterfile) as src:
+        no_data = src.nodata
+    if no_data is not None:
+        values[values == no_data] = -9999
+    df = pd.DataFrame({fieldname: points[fieldname].values, "RasterVal": values})
     return df
 
 
 ##############################################################################
 
 
-def Reclass(inras, outras, reclass_dict, dtype=None):
+def reclass_lookup(reclass_dict, nodata, integer=True, max_span=2**20):
+    """
+    Builds the lookup of a reclass from old to new values, NaN new values
+    become `nodata`. Integer keys spanning at most `max_span` values of an
+    integer raster get a dense table where unmapped values map to
+    themselves, other keys a sorted key array for `searchsorted`.
+
+    Arguments
+    ---------
+    reclass_dict    : mapping of old to new values, i.e. a lookup csv's dict or `rat_to_dict`
+    nodata          : output nodata value
+    integer         : whether the input raster has an integer dtype
+    max_span        : largest key range given a dense table
+
+    Returns
+    ---------
+    tuple
+        (sorted keys, new values, (first key, dense table) or None)
+    """
+    keys = np.array(list(reclass_dict.keys()), dtype=float)
+    values = np.array(list(reclass_dict.values()), dtype=float)
+    values[np.isnan(values)] = nodata
+    order = np.argsort(keys)
+    keys, values = keys[order], values[order]
+    lut = None
+    if (
+        integer
+        and len(keys)
+        and (keys == np.floor(keys)).all()
+        and keys[-1] - keys[0] < max_span
+    ):
+        first = int(keys[0])
+        table = np.arange(first, int(keys[-1]) + 1, dtype=float)
+        table[keys.astype(np.int64) - first] = values
+        lut = (first, table)
+    return keys, values, lut
+
+
+def reclass_block(block, keys, values, lut=None):
+    """
+    Reclasses a block with the lookup from `reclass_lookup`, a single
+    `np.take` into the dense table or one `searchsorted` over the keys,
+    values without a key are left as they are.
+    """
+    if lut is not None:
+        first, table = lut
+        idx = block.astype(np.int64) - first
+        inside = (idx >= 0) & (idx < len(table))
+        out = block.astype(float)
+        out[inside] = np.take(table, idx[inside])
+        return out
+    pos = np.searchsorted(keys, block).clip(0, len(keys) - 1)
+    return np.where(keys[pos] == block, values[pos], block)
+
+
+def Reclass(inras, outras, reclass_dict, dtype=None, n_jobs=None):
     """
     __author__ =   "Marc Weber <weber.marc@epa.gov>"
                    "Ryan Hill <hill.ryan@epa.gov>"
-    reclass a set of values in a raster to another value
+    reclass a set of values in a raster to another value. Each block window
+    is reclassed in one lookup pass in a thread pool and written in order.
 
     Arguments
     ---------
     inras           : an input raster file
     outras          : an output raster file
     reclass_dict    : dictionary of lookup values read in from lookup csv file
+                      or from `rat_to_dict`
     in_nodata       : Returned no data values from
     out_dtype       : the data type of the raster, i.e. 'float32', 'uint8' (string)
+    n_jobs          : number of block workers, defaults to ThreadPoolExecutor's
     """
 
     with rasterio.open(inras) as src:
@@ -278,26 +567,26 @@ def Reclass(inras, outras, reclass_dict, dtype=None):
             bigtiff="YES",  # Output will be larger than 4GB
         )
 
-        windows = src.block_windows(1)
+        windows = [window for _, window in src.block_windows(1)]
+        integer = np.issubdtype(np.dtype(src.dtypes[0]), np.integer)
+    keys, values, lut = reclass_lookup(reclass_dict, nd, integer)
 
-        with rasterio.open(outras, "w", **kwargs) as dst:
-            for idx, window in windows:
-                src_data = src.read(1, window=window)
-                # Convert values
-                # src_data = np.where(src_data == in_nodata, nd, src_data).astype(dtype)
-                for inval, outval in reclass_dict.iteritems():
-                    if np.isnan(outval).any():
-                        # src_data = np.where(src_data != inval, src_data, kwargs['nodata']).astype(dtype)
-                        src_data = np.where(src_data == inval, nd, src_data).astype(
-                            dtype
-                        )
-                    else:
-                        src_data = np.where(src_data == inval, outval, src_data).astype(
-                            dtype
-                        )
-                # src_data = np.where(src_data == inval, outval, src_data)
-                dst_data = src_data
-                dst.write_band(1, dst_data, window=window)
+    def reclass_window(window):
+        block = thread_dataset(inras).read(1, window=window)
+        return reclass_block(block, keys, values, lut).astype(dtype)
+
+    n_jobs = n_jobs or min(32, (os.cpu_count() or 1) + 4)
+    with RasterPool(n_jobs) as pool, rasterio.open(outras, "w", **kwargs) as dst:
+        # a few blocks per worker are in flight, the writes keep window order
+        pending = deque()
+        for window in windows:
+            pending.append((window, pool.submit(reclass_window, window)))
+            if len(pending) >= 2 * n_jobs:
+                done, future = pending.popleft()
+                dst.write_band(1, future.result(), window=done)
+        while pending:
+            done, future = pending.popleft()
+            dst.write_band(1, future.result(), window=done)
 
 
 ##############################################################################
@@ -600,21 +889,84 @@ def get_raster_value_at_points(
     if isinstance(points, gpd.GeoDataFrame):
         assert points.geometry.type.all() == "Point"
         if fieldname:
-            points.set_index(fieldname)
-        points = points.geometry.apply(lambda g: (g.x, g.y))
-    if isinstance(points, Generator):
-        pass
+            points = points.set_index(fieldname)
+        index = points.index
+        x, y = points.geometry.x.values, points.geometry.y.values
+    else:
+        xy = np.array(list(points), dtype=float).reshape(-1, 2)
+        index = pd.RangeIndex(len(xy))
+        x, y = xy.T
 
-    with rasterio.open(rasterfile) as src:
-        data = [s[0] for s in src.sample(points)]
+    data = sample_raster(rasterfile, x, y)
 
     if out_df:
-        return pd.DataFrame(index=points.index, data={val_name: data})
+        return pd.DataFrame(index=index, data={val_name: data})
     else:
-        return data
+        return data.tolist()
+
+
+def sample_raster(rasterfile, x, y, fill=None, band=1, n_jobs=None):
+    """
+    Samples one band of a raster at each point. Coordinates are turned into
+    rows and columns with the inverse affine transform, points are grouped by
+    the internal tile they fall in and each tile holding points is read once
+    in a thread pool, values are gathered with fancy indexing. Only a tile
+    per worker is in memory at a time.
+
+    Arguments
+    ---------
+    rasterfile            : string to the raster
+    x, y                  : numpy arrays of point coordinates in the raster's crs
+    fill                  : value of points off the raster, the raster's nodata
+                            (or 0 without one) when None
+    band                  : band sampled
+    n_jobs                : number of tile readers, defaults to ThreadPoolExecutor's
 
+    Returns
+    ---------
+    numpy array
+        value of each point
+    """
+    with rasterio.open(rasterfile) as src:
+        if fill is None:
+            fill = 0 if src.nodata is None else src.nodata
+        cols, rows = ~src.transform * (np.asarray(x, float), np.asarray(y, float))
+        rows, cols = np.floor(rows).astype(np.int64), np.floor(cols).astype(np.int64)
+        # widened only when the raster's dtype can't hold `fill`, i.e. -9999 for
+        # uint8, rasterio's nodata is a float even for integer rasters
+        dtype = np.dtype(src.dtypes[band - 1])
+        if dtype.kind in "iu" and float(fill).is_integer():
+            if not np.iinfo(dtype).min <= fill <= np.iinfo(dtype).max:
+                dtype = np.result_type(dtype, np.min_scalar_type(int(fill)))
+        else:
+            dtype = np.result_type(dtype, np.min_scalar_type(fill))
+        inside = np.flatnonzero(
+            (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
+        )
+        height, width = src.block_shapes[band - 1]
+        ntcols = -(-src.width // width)
+    out = np.full(len(rows), fill, dtype=dtype)
+    tiles = (rows[inside] // height) * ntcols + cols[inside] // width
+    order = np.argsort(tiles, kind="stable")
+    codes, starts = np.unique(tiles[order], return_index=True)
+
+    def read(tile, idx):
+        src = thread_dataset(rasterfile)
+        r0, c0 = (tile // ntcols) * height, (tile % ntcols) * width
+        window = Window(
+            c0, r0, min(width, src.width - c0), min(height, src.height - r0)
+        )
+        # points of different tiles never share a position in `out`
+        out[idx] = src.read(band, window=window)[rows[idx] - r0, cols[idx] - c0]
+
+    with RasterPool(n_jobs) as pool:
+        list(pool.map(read, codes, np.split(inside[order], starts[1:])))
+    return out
 
-def mask_points(points, mask_dir, INPUTS, nodata_vals=[0, -2147483648.0]):
+
+def mask_points(
+    points, mask_dir, INPUTS, nodata_vals=[0, -2147483648.0], n_jobs=None
+):
     """
     Filter points to those that only lie within the mask.
 
@@ -628,6 +980,8 @@ def mask_points(points, mask_dir, INPUTS, nodata_vals=[0, -2147483648.0]):
         dictionary of vector processing units and hydroregions from NHDPlusV21
     nodata_vals: list
         values of the raster that exist outside of the mask zone
+    n_jobs: int
+        number of VPU masks sampled at once, defaults to ThreadPoolExecutor's
 
     Returns
     ---------
@@ -635,15 +989,146 @@ def mask_points(points, mask_dir, INPUTS, nodata_vals=[0, -2147483648.0]):
         filtered points that only lie within the masked areas
 
     """
-    temp = pd.DataFrame(index=points.index)
-    for zone, hydroregion in INPUTS.items():
-        pts = get_raster_value_at_points(points, f"{mask_dir}/{zone}.tif", out_df=True)
-        temp = temp.merge(~pts.isin(nodata_vals), left_index=True, right_index=True)
-    xx = temp.sum(axis=1)
-    return points.iloc[xx.loc[xx == 1].index]
+    x, y = points.geometry.x.values, points.geometry.y.values
+
+    def in_mask(zone):
+        # each VPU's mask only samples the points inside of its extent
+        rasterfile = f"{mask_dir}/{zone}.tif"
+        left, bottom, right, top = thread_dataset(rasterfile).bounds
+        idx = np.flatnonzero((x >= left) & (x < right) & (y > bottom) & (y <= top))
+        # the VPUs are the parallel work, each mask's tiles are read in turn
+        values = sample_raster(rasterfile, x[idx], y[idx], n_jobs=1)
+        return idx[~np.isin(values, nodata_vals)]
+
+    # a point is kept when exactly one VPU's mask holds it
+    hits = np.zeros(len(points), dtype=np.int32)
+    with RasterPool(n_jobs) as pool:
+        for idx in pool.map(in_mask, INPUTS):
+            hits[idx] += 1
+    return points.iloc[np.flatnonzero(hits == 1)]
+
+
+# catchment polygons by (shapefile, crs, fingerprint), see `catchment_frame`
+_catchment_frames = OrderedDict()
+
+
+def catchment_frame(catchments, crs, cache_dir=None, max_frames=1):
+    """
+    Returns the catchment polygons of a VPU in `crs` with their spatial index
+    built. The `max_frames` most recently used VPUs are kept in memory, with
+    `cache_dir` the projected polygons are also kept as GeoParquet, so other
+    metrics and later runs skip the shapefile read and `to_crs`, they are
+    rebuilt when the shapefile changes.
+
+    Arguments
+    ---------
+    catchments            : string to the NHDPlus Catchment.shp of a VPU
+    crs                   : crs of the points joined to the catchments
+    cache_dir             : directory of the GeoParquet catchments, or None
+    max_frames            : number of VPUs held in memory with their spatial index
+
+    Returns
+    ---------
+    gpd.GeoDataFrame
+        catchment polygons in `crs`
+    """
+    key = (str(catchments), str(crs), file_fingerprint(catchments))
+    polys = _catchment_frames.get(key)
+    if polys is not None:
+        _catchment_frames.move_to_end(key)
+        return polys
+    path = None
+    if cache_dir:
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+        path = f"{cache_dir}/{Path(catchments).stem}_{digest}.parquet"
+    if path and os.path.exists(path):
+        polys = gpd.read_parquet(path)
+    else:
+        polys = gpd.read_file(catchments).to_crs(crs)
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            polys.to_parquet(f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+    polys.sindex  # built once, it is kept with the frame
+    _catchment_frames[key] = polys
+    while len(_catchment_frames) > max_frames:
+        _catchment_frames.popitem(last=False)
+    return polys
+
+
+# FEATUREID of each point by point coordinates and zone, see `point_assignment`
+_point_assignments = {}
+
+
+def point_assignment(points, vpu, catchments, accum_dir="accum_npy", cache_dir=None):
+    """
+    Assigns each point the FEATUREID of the catchment grid cell it falls in,
+    sampled from the zone's `ZoneRuns` so no polygon geometry is read. The
+    assignments are keyed by the point coordinates, metrics that share a
+    point layer with another summaryfield or AppendMetric reuse them, they
+    are kept per process and with `cache_dir` as .npy files.
 
+    Arguments
+    ---------
+    points                : gpd.GeoDataFrame of points
+    vpu                   : string of an NHDPlusV2 VPU zone, i.e. 10L, 16, 17
+    catchments            : string to the NHDPlus Catchment.shp of the VPU, the
+                            catchment grid `cat` sits beside it
+    accum_dir             : directory where the topology and zone runs are stored
+    cache_dir             : directory of the stored assignments, or None
 
-def PointInPoly(points, vpu, catchments, pct_full, mask_dir, appendMetric, summary):
+    Returns
+    ---------
+    numpy array
+        FEATUREID of each point, 0 where it isn't in a catchment
+    """
+    zone_raster = f"{os.path.dirname(catchments)}/cat"
+    x, y = points.geometry.x.values, points.geometry.y.values
+    digest = hashlib.sha1(
+        repr((vpu, str(points.crs), file_fingerprint(zone_raster))).encode()
+    )
+    digest.update(np.ascontiguousarray(x, dtype=float).tobytes())
+    digest.update(np.ascontiguousarray(y, dtype=float).tobytes())
+    key = digest.hexdigest()
+    fids = _point_assignments.get(key)
+    if fids is not None:
+        return fids
+    path = f"{cache_dir}/points_{vpu}_{key[:16]}" if cache_dir else None
+    if path and os.path.exists(f"{path}.npy"):
+        fids = np.load(f"{path}.npy")
+    else:
+        with rasterio.open(zone_raster) as src:
+            crs = src.crs
+        geom = points.geometry.to_crs(crs.to_wkt())
+        codes = load_zone_runs(vpu, zone_raster, accum_dir).sample(
+            geom.x.values, geom.y.values
+        )
+        cat = dbf2DF(f"{os.path.splitext(catchments)[0]}.dbf")
+        cat = cat[["GRIDCODE", "FEATUREID"]].sort_values("GRIDCODE")
+        pos = np.searchsorted(cat.GRIDCODE.values, codes).clip(0, len(cat) - 1)
+        found = cat.GRIDCODE.values[pos] == codes
+        fids = np.where(found, cat.FEATUREID.values[pos], 0).astype(np.int64)
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.save(f"{path}.tmp.npy", fids)
+            os.replace(f"{path}.tmp.npy", f"{path}.npy")
+    _point_assignments[key] = fids
+    return fids
+
+
+def PointInPoly(
+    points,
+    vpu,
+    catchments,
+    pct_full,
+    mask_dir,
+    appendMetric,
+    summary,
+    cache_dir=None,
+    assign="polygon",
+    accum_dir="accum_npy",
+    cache=None,
+):
     """
     Filter points to those that only lie within the mask.
 
@@ -665,6 +1150,16 @@ def PointInPoly(points, vpu, catchments, pct_full, mask_dir, appendMetric, summa
     summary: list
         strings that identify columns from the attribute table in the points
         GeoDataFrame to be summed in returned DataFrame if `summary` is defined
+    cache_dir: str
+        directory of the GeoParquet catchments and stored point assignments
+    assign: str
+        "polygon" to join the points within the catchment polygons, "raster"
+        to look each point up in the 30 m catchment grid, see `point_assignment`
+    accum_dir: str
+        directory where the zone runs of the catchment grids are stored
+    cache: ZonalCache
+        cache of zonal tables, the mask's cell counts are taken from it with
+        `stashZonal` when the mask has no raster attribute table
 
     Returns
     ---------
@@ -675,69 +1170,79 @@ def PointInPoly(points, vpu, catchments, pct_full, mask_dir, appendMetric, summa
 
     """
 
-    polys = gpd.GeoDataFrame.from_file(catchments)
-    polys.to_crs(points.crs, inplace=True)
+    if assign not in ("polygon", "raster"):
+        raise ValueError(f"unknown point assignment {assign!r}")
+    if assign == "polygon":
+        polys = catchment_frame(catchments, points.crs, cache_dir)
+        areas = pd.DataFrame(polys[["FEATUREID", "GRIDCODE", "AreaSqKM"]])
+    else:
+        areas = dbf2DF(f"{os.path.splitext(catchments)[0]}.dbf")
+        areas = areas[["FEATUREID", "GRIDCODE", "AREASQKM"]].rename(
+            columns={"AREASQKM": "AreaSqKM"}
+        )
     if mask_dir:
-        rat = dbf2DF(f"{mask_dir}/{vpu}.tif.vat.dbf")
+        rat_file = f"{mask_dir}/{vpu}.tif.vat.dbf"
+        if os.path.exists(rat_file):
+            rat = dbf2DF(rat_file)
+        elif cache is not None:
+            # count the mask's cells over the catchment grid beside the catchments,
+            # the counts are shared with the metrics summarized within the mask
+            mask = f"{mask_dir}/{vpu}.tif"
+            zone_runs = load_zone_runs(
+                vpu, f"{os.path.dirname(catchments)}/cat", accum_dir
+            )
+            rat = stashZonal(zone_runs, [(mask, "Mask")], cache)[mask, "Mask", None]
+        else:
+            rat = zonal_tables(
+                f"{os.path.dirname(catchments)}/cat", [(f"{mask_dir}/{vpu}.tif", "Mask")]
+            )[0]
         rat["AreaSqKM"] = ((rat.COUNT * 900) * 1e-6).fillna(0)
-        polys = pd.merge(
-            polys.drop("AreaSqKM", axis=1),
+        areas = pd.merge(
+            areas.drop("AreaSqKM", axis=1),
             rat[["VALUE", "AreaSqKM"]],
             left_on="GRIDCODE",
             right_on="VALUE",
             how="left",
         )
 
-    # Get list of lat/long fields in the table
-    points["latlon_tuple"] = tuple(
-        zip(
-            points.geometry.map(lambda point: point.x),
-            points.geometry.map(lambda point: point.y),
+    x, y = points.geometry.x.values, points.geometry.y.values
+    if assign == "polygon":
+        # one join for the count and every summary, only the points inside
+        # the VPU's bounding box are tested against the polygons
+        minx, miny, maxx, maxy = polys.total_bounds
+        inside = np.flatnonzero(
+            (x >= minx) & (x <= maxx) & (y >= miny) & (y <= maxy)
         )
-    )
-    # Remove duplicate points for 'Count'
-    points2 = points.drop_duplicates("latlon_tuple")
-    try:
-        point_poly_join = sjoin(points2, polys, how="left", op="within")
-        fld = "GRIDCODE"
-    except:
-        polys["link"] = np.nan
-        point_poly_join = polys
-        fld = "link"
-    # Create group of all points in catchment
-    grouped = point_poly_join.groupby("FEATUREID")
-    point_poly_count = grouped[fld].count()
-    point_poly_count.name = "COUNT"
+        pts, hits = polys.sindex.query(
+            points.geometry.values[inside], predicate="within"
+        )
+        rows, fids = inside[pts], polys.FEATUREID.values[hits]
+    else:
+        fids = point_assignment(points, vpu, catchments, accum_dir, cache_dir)
+        rows = np.flatnonzero(fids)
+        fids = fids[rows]
+    # 'Count' is of distinct locations, summaries include the duplicates
+    first = ~pd.DataFrame({"x": x, "y": y}).duplicated().values
+    joined = pd.DataFrame({"FEATUREID": fids, "COUNT": first[rows]})
+    summary = summary or []
+    for fld in summary:
+        joined[fld] = points[fld].values[rows]
+    stats = joined.groupby("FEATUREID").sum()
     # Join Count column on to NHDCatchments table and keep only
     # ['COMID','CatAreaSqKm','CatCount']
-    final = polys.join(point_poly_count, on="FEATUREID", lsuffix="_", how="left")
-    final = final[["FEATUREID", "AreaSqKM", "COUNT"]].fillna(0)
+    final = areas.join(stats, on="FEATUREID", how="left")
+    final = final[["FEATUREID", "AreaSqKM", "COUNT"] + summary].fillna(0)
     cols = ["COMID", f"CatAreaSqKm{appendMetric}", f"CatCount{appendMetric}"]
-    if not summary == None:  # Summarize fields including duplicates
-        point_poly_dups = sjoin(points, polys, how="left", op="within")
-        grouped2 = point_poly_dups.groupby("FEATUREID")
-        for x in summary:  # Sum the field in summary field list for each catchment
-            point_poly_stats = grouped2[x].sum()
-            point_poly_stats.name = x
-            final = final.join(point_poly_stats, on="FEATUREID", how="left").fillna(0)
-            cols.append("Cat" + x + appendMetric)
+    cols += ["Cat" + fld + appendMetric for fld in summary]
     final.columns = cols
     # Merge final table with Pct_Full table based on COMID and fill NA's with 0
     final = pd.merge(final, pct_full, on="COMID", how="left")
     if len(mask_dir) > 0:
-        if not summary == None:
-            final.columns = (
-                ["COMID", "CatAreaSqKmRp100", "CatCountRp100"]
-                + ["Cat" + y + appendMetric for y in summary]
-                + ["CatPctFullRp100"]
-            )
-        else:
-            final.columns = [
-                "COMID",
-                "CatAreaSqKmRp100",
-                "CatCountRp100",
-                "CatPctFullRp100",
-            ]
+        final.columns = (
+            ["COMID", "CatAreaSqKmRp100", "CatCountRp100"]
+            + ["Cat" + y + appendMetric for y in summary]
+            + ["CatPctFullRp100"]
+        )
     final[f"CatPctFull{appendMetric}"] = final[f"CatPctFull{appendMetric}"].fillna(100)
     for name in final.columns:
         if "AreaSqKm" in name:
@@ -771,7 +1276,7 @@ def rat_to_dict(inraster, old_val, new_val):
     # data type automatically
     s = [
         pd.Series(rat.ReadAsArray(i), name=rat.GetNameOfCol(i))
-        for i in xrange(rat.GetColumnCount())
+        for i in range(rat.GetColumnCount())
     ]
     # Convert the RAT to a pandas dataframe
     df = pd.concat(s, axis=1)
@@ -786,7 +1291,7 @@ def rat_to_dict(inraster, old_val, new_val):
 ##############################################################################
 
 
-def interVPU(tbl, cols, accum_type, zone, Connector, interVPUtbl):
+def interVPU(tbl, cols, accum_type, zone, to_zone_table, interVPUtbl):
     """
     Loads watershed values for given COMIDs to be appended to catResults table for accumulation.
 
@@ -796,8 +1301,13 @@ def interVPU(tbl, cols, accum_type, zone, Connector, interVPUtbl):
     cols                  : list of columns from Cat Results table needed to overwrite onto Connector table
     accum_type            : type metric to be accumulated, i.e. 'Categorical', 'Continuous', 'Count'
     zone                  : an NHDPlusV2 VPU number, i.e. 10, 16, 17
-    Connector             : Location of the connector file
+    to_zone_table         : Location of the ToZone's Cat Results table, only read when the zone has toCOMIDs
     InterVPUtbl           : table of interVPU exchanges
+
+    Returns
+    ---------
+    pd.DataFrame
+        connector rows indexed by COMID, to be added to the `ConnectorStore`
     """
     # Create subset of the tbl with a COMID in interVPUtbl
     throughVPUs = (
@@ -810,12 +1320,8 @@ def interVPU(tbl, cols, accum_type, zone, Connector, interVPUtbl):
     # COMIDs in the toCOMID column need to swap values with COMIDs in other
     # zones, those COMIDS are then sorted in toVPUS
     if any(interVPUtbl.toCOMIDs.values > 0):
-        interAlloc = "%s_%s.csv" % (
-            Connector[: Connector.find("_connectors")],
-            interVPUtbl.ToZone.values[0],
-        )
-        tbl = pd.read_csv(interAlloc).set_index("COMID")
-        toVPUs = tbl[tbl.index.isin([x for x in interVPUtbl.toCOMIDs if x > 0])].copy()
+        tbl = pd.read_csv(to_zone_table, engine="pyarrow").set_index("COMID")
+        toVPUs = tbl[tbl.index.isin(interVPUtbl.toCOMIDs.values[interVPUtbl.toCOMIDs.values > 0])].copy()
     for _, row in interVPUtbl.iterrows():
         # Loop through sub-setted interVPUtbl to make adjustments to COMIDS listed in the table
         if row.toCOMIDs > 0:
@@ -825,15 +1331,8 @@ def interVPU(tbl, cols, accum_type, zone, Connector, interVPUtbl):
         if row.DropCOMID > 0:
             throughVPUs = throughVPUs.drop(int(row.DropCOMID))
     if any(interVPUtbl.toCOMIDs.values > 0):
-        con = pd.read_csv(Connector).set_index("COMID")
-        con.columns = map(str, con.columns)
-        toVPUs = pd.concat([toVPUs,con], axis=0, ignore_index=False)
-        toVPUs.to_csv(Connector)
-    if os.path.exists(Connector):  # if Connector already exists, read it in and append
-        con = pd.read_csv(Connector).set_index("COMID")
-        con.columns = map(str, con.columns)
-        throughVPUs = pd.concat([throughVPUs, con], axis=0, ignore_index=False) 
-    throughVPUs.to_csv(Connector)
+        throughVPUs = pd.concat([throughVPUs, toVPUs], axis=0, ignore_index=False)
+    return throughVPUs
 
 
 ##############################################################################
@@ -854,105 +1353,358 @@ def AdjustCOMs(tbl, comid1, comid2, tbl2=None):
 
     if tbl2 is None:  # might be able to fix this in the arguments
         tbl2 = tbl.copy()
-    for idx in tbl.columns[:-1]:
+    for idx in tbl.columns[~tbl.columns.str.contains("PctFull")]:
         tbl.loc[comid1, idx] = tbl.loc[comid1, idx] - tbl2.loc[comid2, idx]
 
 ##############################################################################
-def accum_values(index, column, tbl, indices, accumulated_indexes, tbl_type, lengths):
-    # Function used to parallelize accumulation step
 
-    col_values = tbl[column].values.astype("float")
-    all_values = np.split(col_values[indices], accumulated_indexes)
-    if tbl_type == "Ws":
-        # add identity value to each array for full watershed
-        all_values = np.array(
-            [np.append(val, col_values[idx]) for idx, val in enumerate(all_values)],
-            dtype=object,
-        )
 
-        # all_values = [np.append(val, col_values[idx]) for idx, val in enumerate(all_values)]
+def segment_reduce(values, offsets, ufunc, identity):
+    """
+    Reduces consecutive segments of `values`, delimited by `offsets`, with
+    `ufunc.reduceat` along the first axis. reduceat returns the next value for
+    a zero length segment, so empty segments are set to `identity` instead.
+
+    Arguments
+    ---------
+    values                : numpy array of gathered upstream values, 1 or 2 dimensional
+    offsets               : numpy array of segment start positions, one longer than the number of segments
+    ufunc                 : numpy ufunc used to reduce each segment, i.e. np.add, np.maximum
+    identity              : value returned for empty segments
+    """
+    starts = offsets[:-1]
+    filled = offsets[1:] > starts
+    out = np.full((len(starts),) + values.shape[1:], identity, dtype=float)
+    if filled.any():
+        out[filled] = ufunc.reduceat(values, starts[filled], axis=0)
+    return out
+
+
+def nan_zero(values):
+    # same as the NaN handling in np.nansum, leaves inf alone unlike np.nan_to_num
+    return np.where(np.isnan(values), 0, values)
+
+
+def accum_reduction(column):
+    """
+    Returns the name of the reduction used to accumulate a catchment column:
+    'mean' for PctFull, 'max'/'min' for MAX/MIN columns and 'sum' otherwise.
 
-    # if index == 1:
-    area = all_values.copy()
+    Arguments
+    ---------
+    column                : name of the Cat column
+    """
     if "PctFull" in column:
-        values = [
-            np.ma.average(np.nan_to_num(val), weights=w) # changed from np.ma.average
-            for val, w in zip(all_values, area)
-        ]
-    elif "MIN" in column or "MAX" in column:
-        func = np.max if "MAX" in column else np.min
+        return "mean"
+    if "MAX" in column:
+        return "max"
+    if "MIN" in column:
+        return "min"
+    return "sum"
+
+
+def reduce_upstream(values, up_values, offsets, reduction, area=None, up_area=None):
+    """
+    Accumulates one or more columns of catchment values over their upstream
+    segments with a single reduction. Both the upstream ('Up') and the full
+    watershed ('Ws') results come from the same pass, Ws adds the local
+    catchment to the reduced upstream segment.
+
+    Arguments
+    ---------
+    values                : numpy array of local catchment values, (n,) or (n, k)
+    up_values             : numpy array of `values` gathered in upstream order
+    offsets               : numpy array of segment start positions in `up_values`, n + 1 long
+    reduction             : one of 'sum', 'max', 'min' or 'mean', see `accum_reduction`
+    area                  : numpy array of catchment areas (n,), weights used for 'mean'
+    up_area               : numpy array of `area` gathered in upstream order
+
+    Returns
+    ---------
+    tuple
+        numpy arrays of the Up and Ws values, shaped like `values`
+    """
+    if reduction == "mean":
+        # mean of upstream (and local for Ws) values weighted by catchment area
+        if values.ndim == 2:
+            area, up_area = area[:, None], up_area[:, None]
+        num = segment_reduce(np.nan_to_num(up_values) * up_area, offsets, np.add, 0)
+        den = segment_reduce(up_area, offsets, np.add, 0)
+        ws_num = num + np.nan_to_num(values) * area
+        ws_den = den + area
+        with np.errstate(divide="ignore", invalid="ignore"):
+            up = np.where(den == 0, np.nan, num / den)
+            ws = np.where(ws_den == 0, np.nan, ws_num / ws_den)
+    elif reduction in ("max", "min"):
+        func = np.maximum if reduction == "max" else np.minimum
         # initial is necessary to eval empty upstream arrays
         # these values will be overwritten w/ nan later
+        initial = -999999 if reduction == "max" else 999999
+        up = func(segment_reduce(up_values, offsets, func, initial), initial)
+        ws = func(up, values)
+        empty = offsets[1:] == offsets[:-1]
+        up[empty] = values[empty]
+        ws[empty] = values[empty]
+    else:
+        up = segment_reduce(nan_zero(up_values), offsets, np.add, 0)
+        ws = up + nan_zero(values)
+    return up, ws
 
-        # initial = -999 if "MAX" in column else 999999
 
-        initial = -999999 if "MAX" in column else 999999
+def segment_chunks(offsets, limit):
+    """
+    Splits the COMIDs of a topology into consecutive (start, stop) ranges
+    whose upstream segments hold at most `limit` values, a range always holds
+    at least one COMID.
 
-        values = np.array([func(val, initial=initial) for val in all_values])
-        values[lengths == 0] = col_values[lengths == 0]
-    else:
-        values = np.array([np.nansum(val) for val in all_values])
-    
-    return index, values
+    Arguments
+    ---------
+    offsets               : numpy array of segment start positions, one longer than the number of COMIDs
+    limit                 : maximum number of upstream values in a range
+    """
+    n = len(offsets) - 1
+    start = 0
+    while start < n:
+        stop = np.searchsorted(offsets, offsets[start] + limit, side="right") - 1
+        stop = min(max(stop, start + 1), n)
+        yield start, stop
+        start = stop
 
 
-##############################################################################
+def accum_values(index, column, tbl, indices, offsets):
+    # Function used to parallelize accumulation step
 
+    col_values = tbl[column].values.astype("float")
+    reduction = accum_reduction(column)
+    area = up_area = None
+    if reduction == "mean":
+        area = tbl.iloc[:, 1].values.astype("float")
+        up_area = area[indices]
+    up, ws = reduce_upstream(
+        col_values, col_values[indices], offsets, reduction, area, up_area
+    )
+    return index, up, ws
 
-def Accumulation(tbl, comids, lengths, upstream, tbl_type, icol="COMID"):
+
+def reduce_matrix(matrix, values, reduction, area):
     """
-    __author__ =  "Ryan Hill <hill.ryan@epa.gov>"
-                  "Marc Weber <weber.marc@epa.gov>"
-                  
-    Uses the 'Cat' and 'UpCat' columns to caluculate watershed values and returns those values in 'Cat' columns
-        so they can be appended to 'CatResult' tables in other zones before accumulation.
+    Accumulates columns of catchment values with the upstream incidence
+    matrix, upstream sums are `matrix @ values`. Only valid for the additive
+    reductions, 'sum' and the area weighted 'mean'.
 
     Arguments
     ---------
-    tbl                   : table containing watershed values
-    comids                : numpy array of all zones comids
-    lengths               : numpy array with lengths of upstream comids
-    upstream              : numpy array of all upstream arrays for each COMID
-    tbl_type              : string value of table metrics to be returned
-    icol                  : column in arr object to index
+    matrix                : scipy.sparse CSR matrix of COMID x upstream COMID, see `upstream_matrix`
+    values                : numpy array of local catchment values, (n, k)
+    reduction             : 'sum' or 'mean'
+    area                  : numpy array of catchment areas (n,), weights used for 'mean'
+
+    Returns
+    ---------
+    tuple
+        numpy arrays of the Up and Ws values, shaped like `values`
     """
-    # RuntimeWarning: invalid value encountered in double_scalars
-    # np.seterr(all="ignore")
-    
-    coms = tbl[icol].values.astype("int32")  # Read in comids
-    indices = swapper(coms, upstream)  # Get indices that will be used to map values
-    del upstream  # a and indices are big - clean up to minimize RAM
-    cols = tbl.columns[1:]  # Get column names that will be accumulated
-    z = np.zeros(comids.shape)  # Make empty vector for placing values
-    data = np.zeros((len(comids), len(tbl.columns)))
-    data[:, 0] = comids  # Define first column as comids
-    accumulated_indexes = np.add.accumulate(lengths)[:-1]
-    # accumulated_indexes = np.ufunc.accumulate(lengths)[:-1]
-    # accumulated_indexes = np.cumsum(lengths)[:-1]
-    accum_results = []
-    # Loop and accumulate values
-    # for index, column in enumerate(cols, 1):
-    # process_start = time.time()
-    accum_results = Parallel(n_jobs=-1)(
-        delayed(accum_values)(index, column, tbl, indices, accumulated_indexes, tbl_type, lengths) for index, column in enumerate(cols, 1)
+    if reduction == "mean":
+        local = np.nan_to_num(values) * area[:, None]
+        num = matrix @ local
+        den = matrix @ area
+        ws_den = den + area
+        with np.errstate(divide="ignore", invalid="ignore"):
+            up = np.where(den[:, None] == 0, np.nan, num / den[:, None])
+            ws = np.where(ws_den[:, None] == 0, np.nan, (num + local) / ws_den[:, None])
+        return up, ws
+    local = nan_zero(values)
+    up = matrix @ local
+    return up, up + local
+
+
+def accum_table(tbl, indices, offsets, chunk_size=2**26, matrix=None):
+    """
+    Accumulates every column of `tbl` at once. The columns are held as one
+    contiguous float matrix that is gathered in upstream order a single time
+    per chunk of COMIDs, then each group of columns sharing a reduction (sum,
+    max, min, area weighted PctFull) is reduced over the same segments. When
+    the upstream incidence `matrix` is given the sum and PctFull groups are
+    a sparse matrix product instead and only MIN/MAX columns are gathered.
+
+    Arguments
+    ---------
+    tbl                   : table of catchment values in the order of the topology, COMID first and area second
+    indices               : numpy array of row positions of every upstream COMID, from `swapper`
+    offsets               : numpy array of segment start positions in `indices`, len(tbl) + 1 long
+    chunk_size            : maximum number of gathered values held in memory at once
+    matrix                : scipy.sparse CSR matrix of COMID x upstream COMID, see `upstream_matrix`
+
+    Returns
+    ---------
+    tuple
+        numpy arrays of the Up and Ws values for every column after COMID
+    """
+    values = np.ascontiguousarray(tbl.iloc[:, 1:].to_numpy(dtype=float))
+    reductions = np.array([accum_reduction(col) for col in tbl.columns[1:]])
+    groups = {r: np.flatnonzero(reductions == r) for r in np.unique(reductions)}
+    up, ws = np.empty_like(values), np.empty_like(values)
+    if matrix is not None:
+        for reduction in ("sum", "mean"):
+            if reduction in groups:
+                pos = groups.pop(reduction)
+                up[:, pos], ws[:, pos] = reduce_matrix(
+                    matrix, values[:, pos], reduction, values[:, 0]
+                )
+    if not groups:
+        return up, ws
+    # gather only the columns left to reduce, area stays first for the weights
+    cols = np.unique(np.concatenate([[0]] + list(groups.values())))
+    sub = values if len(cols) == values.shape[1] else values[:, cols]
+    sub_groups = {r: np.searchsorted(cols, pos) for r, pos in groups.items()}
+    limit = max(chunk_size // sub.shape[1], 1)
+    for start, stop in segment_chunks(offsets, limit):
+        seg = offsets[start : stop + 1]
+        up_values = sub[indices[seg[0] : seg[-1]]]
+        local = sub[start:stop]
+        for reduction, pos in sub_groups.items():
+            out_pos = groups[reduction]
+            up[start:stop, out_pos], ws[start:stop, out_pos] = reduce_upstream(
+                local[:, pos],
+                up_values[:, pos],
+                seg - seg[0],
+                reduction,
+                local[:, 0],
+                up_values[:, 0],
+            )
+    return up, ws
+
+
+# reductions in the order of the codes used by the numba kernel
+ACCUM_CODES = ("sum", "max", "min", "mean")
+
+if njit is not None:
+
+    @njit(parallel=True, cache=True)
+    def _accum_kernel(values, indices, offsets, codes, up, ws):
+        # one COMID per iteration, column 0 of `values` is the catchment area
+        for i in prange(values.shape[0]):
+            start, stop = offsets[i], offsets[i + 1]
+            area = values[i, 0]
+            up_area = 0.0
+            for j in range(start, stop):
+                up_area += values[indices[j], 0]
+            for c in range(values.shape[1]):
+                local = values[i, c]
+                code = codes[c]
+                if code == 0:
+                    acc = 0.0
+                    for j in range(start, stop):
+                        v = values[indices[j], c]
+                        if not np.isnan(v):
+                            acc += v
+                    up[i, c] = acc
+                    ws[i, c] = acc if np.isnan(local) else acc + local
+                elif code == 1 or code == 2:
+                    if start == stop:
+                        up[i, c] = local
+                        ws[i, c] = local
+                        continue
+                    # initial sentinels match the numpy engines
+                    acc = -999999.0 if code == 1 else 999999.0
+                    for j in range(start, stop):
+                        v = values[indices[j], c]
+                        if np.isnan(v):
+                            acc = np.nan
+                            break
+                        if (code == 1 and v > acc) or (code == 2 and v < acc):
+                            acc = v
+                    up[i, c] = acc
+                    if np.isnan(acc) or np.isnan(local):
+                        ws[i, c] = np.nan
+                    elif (code == 1 and local > acc) or (code == 2 and local < acc):
+                        ws[i, c] = local
+                    else:
+                        ws[i, c] = acc
+                else:
+                    num = 0.0
+                    for j in range(start, stop):
+                        v = values[indices[j], c]
+                        if not np.isnan(v):
+                            num += v * values[indices[j], 0]
+                    up[i, c] = num / up_area if up_area != 0 else np.nan
+                    if not np.isnan(local):
+                        num += local * area
+                    den = up_area + area
+                    ws[i, c] = num / den if den != 0 else np.nan
+
+
+def accum_numba(tbl, indices, offsets):
+    """
+    Accumulates every column of `tbl` with a JIT-compiled kernel that loops
+    over COMIDs in parallel threads, so nothing is copied to worker processes
+    and no gathered copy of the table is held in memory. Reductions are the
+    same as `accum_table`.
+
+    Arguments
+    ---------
+    tbl                   : table of catchment values in the order of the topology, COMID first and area second
+    indices               : numpy array of row positions of every upstream COMID, from `swapper`
+    offsets               : numpy array of segment start positions in `indices`, len(tbl) + 1 long
+
+    Returns
+    ---------
+    tuple
+        numpy arrays of the Up and Ws values for every column after COMID
+    """
+    values = np.ascontiguousarray(tbl.iloc[:, 1:].to_numpy(dtype=float))
+    codes = np.array(
+        [ACCUM_CODES.index(accum_reduction(col)) for col in tbl.columns[1:]],
+        dtype=np.int8,
     )
-    # FOR TESTING LOOP VS PARALLEL SPEEDS
-    # for index, column in enumerate(cols, 1):
-    #     accum_results.append(accum_values(index, column, tbl, indices, accumulated_indexes, tbl_type, lengths))
-    # process_end = time.time()
-    # print(f"Finished accumulating {len(coms)} COMIDS for {len(cols)} columns in {process_end - process_start} seconds with {os.cpu_count()} parallel processes")
+    up, ws = np.empty_like(values), np.empty_like(values)
+    _accum_kernel(
+        values,
+        np.asarray(indices, dtype=np.int64),
+        np.asarray(offsets, dtype=np.int64),
+        codes,
+        up,
+        ws,
+    )
+    return up, ws
 
-    
-    # Extract indices and values
-    all_indices = [index for index, _ in accum_results]
-    all_values = np.array([value for _, value in accum_results]).T
-
-    # Update data using advanced indexing
-    data[:, all_indices] = all_values
-    data = data[np.in1d(data[:, 0], coms), :]  # Remove the extra comids
-    outDF = pd.DataFrame(data)
-    prefix = "UpCat" if tbl_type == "Up" else "Ws"
-    outDF.columns = [icol] + [c.replace("Cat", prefix) for c in cols.tolist()]
+
+def upstream_matrix(n, indices, offsets):
+    """
+    Builds the upstream incidence matrix of a zone, row i holds a 1 in the
+    column of every catchment upstream of COMID i. The CSR arrays of the
+    topology are used as the matrix structure directly.
+
+    Arguments
+    ---------
+    n                     : number of COMIDs in the zone
+    indices               : numpy array of row positions of every upstream COMID, from `swapper`
+    offsets               : numpy array of segment start positions in `indices`, n + 1 long
+    """
+    return sparse.csr_matrix(
+        (np.ones(len(indices)), np.asarray(indices), np.asarray(offsets)),
+        shape=(n, n),
+    )
+
+
+def accum_frame(values, comids, coms, cols, prefix, icol="COMID"):
+    """
+    Formats accumulated values as an 'UpCat' or 'Ws' results table, dropping
+    COMIDs that are not in the cat table and setting every value past the
+    area to NA where there is no area.
+
+    Arguments
+    ---------
+    values                : numpy array of accumulated values for every column after COMID
+    comids                : numpy array of all zones comids
+    coms                  : numpy array of COMIDs in the cat table
+    cols                  : names of the accumulated Cat columns
+    prefix                : 'UpCat' or 'Ws', replaces 'Cat' in the column names
+    icol                  : column in arr object to index
+    """
+    keep = np.isin(comids, coms)  # Remove the extra comids
+    outDF = pd.DataFrame(values[keep], columns=[c.replace("Cat", prefix) for c in cols])
+    outDF.insert(0, icol, np.asarray(comids, dtype=float)[keep])
     areaName = outDF.columns[outDF.columns.str.contains("Area")][0]
     # identifies that there is no area in catchment mask,
     # then NA values for everything past Area, covers upcats w. no area AND
@@ -965,112 +1717,1259 @@ def Accumulation(tbl, comids, lengths, upstream, tbl_type, icol="COMID"):
 ##############################################################################
 
 
-def createCatStats(
-    accum_type,
-    LandscapeLayer,
-    inZoneData,
-    out_dir,
-    zone,
-    by_RPU,
-    mask_dir,
-    NHD_dir,
-    hydroregion,
-    appendMetric,
+def AccumulateUpWs(
+    tbl,
+    comids,
+    offsets,
+    upstream,
+    icol="COMID",
+    engine="auto",
+    matrix=None,
+    indices=None,
 ):
-
     """
-    __author__ =  "Marc Weber <weber.marc@epa.gov>"
-                  "Ryan Hill <hill.ryan@epa.gov>"
-    Uses the arcpy tools to perform ZonalStatisticsAsTable or TabulateArea based on accum_type and then formats
-    the results into a Catchment Results table with 'PctFull'Calculated
+    Calculates the 'UpCat' and 'Ws' tables for a zone from one gather of the
+    cat table. Additive columns derive Ws as Up plus the local catchment,
+    MIN/MAX columns compare the reduced upstream segment with the local value.
 
     Arguments
     ---------
-    accum_type            : type metric to be accumulated, i.e. 'Categorical', 'Continuous', 'Count'
-    LandscapeLayer        : string of the landscape raster name
-    inZoneData            : string to the NHD catchment grid
-    out_dir               : string to directory where output is being stored
-    zone                  : string of an NHDPlusV2 VPU zone, i.e. 10L, 16, 17
+    tbl                   : table containing watershed values
+    comids                : numpy array of all zones comids
+    offsets               : numpy array of start positions in `upstream` for each COMID, len(comids) + 1 long
+    upstream              : numpy array of all upstream arrays for each COMID
+    icol                  : column in arr object to index
+    engine                : 'table' to reduce all columns in one pass, 'sparse' to use the upstream
+                            incidence matrix for additive columns, 'numba' for the parallel compiled
+                            kernel, 'column' for one joblib task per column. 'auto' picks 'numba' and
+                            falls back to 'table' when numba isn't installed, as does 'numba'
+    matrix                : cached upstream incidence matrix for the 'sparse' engine, see `load_upstream_matrix`
+    indices               : row positions of `upstream` in `tbl` from `swapper`, computed when not given
+
+    Returns
+    ---------
+    tuple
+        'UpCat' and 'Ws' pd.DataFrames
     """
+    # RuntimeWarning: invalid value encountered in double_scalars
+    # np.seterr(all="ignore")
 
-    try:
-        arcpy.env.cellSize = "30"
-        arcpy.env.snapRaster = inZoneData
-        if by_RPU == 0:
-            if LandscapeLayer.count(".tif") or LandscapeLayer.count(".img"):
-                landscape_layer = Path(LandscapeLayer).stem  # / vs. \ agnostic
-                outTable = "%s/DBF_stash/zonalstats_%s%s%s.dbf" % (
-                    out_dir,
-                    landscape_layer,
-                    appendMetric,
-                    zone,
-                )
-            else:
-                landscape_layer = Path(LandscapeLayer).name  # / vs. \ agnostic
-                outTable = "%s/DBF_stash/zonalstats_%s%s%s.dbf" % (
-                    out_dir,
-                    landscape_layer,
-                    appendMetric,
-                    zone,
-                )
-            if not os.path.exists(outTable):
-                if accum_type == "Categorical":
-                    TabulateArea(
-                        inZoneData, "VALUE", LandscapeLayer, "Value", outTable, "30"
-                    )
-                if accum_type == "Continuous":
-                    ZonalStatisticsAsTable(
-                        inZoneData, "VALUE", LandscapeLayer, outTable, "DATA", "ALL"
-                    )
-            try:
-                table = dbf2DF(outTable)
-            except fiona.errors.DriverError as e:
-                # arc occassionally doesn't release the file and fails here
-                print(e, "\n\n!EXCEPTION CAUGHT! TRYING AGAIN!")
-                time.sleep(60)
-                table = dbf2DF(outTable)
-        if by_RPU == 1:
-            hydrodir = "/".join(inZoneData.split("/")[:-2]) + "/NEDSnapshot"
-            rpuList = []
-            for subdirs in os.listdir(hydrodir):
-                elev = "%s/%s/elev_cm" % (hydrodir, subdirs)
-                rpuList.append(subdirs[-3:])
-                print("working on " + elev)
-                outTable = out_dir + "/DBF_stash/zonalstats_elev%s.dbf" % (subdirs[-3:])
+    if engine not in ("auto", "numba", "table", "sparse", "column"):
+        raise ValueError(f"unknown accumulation engine {engine!r}")
+    if engine in ("auto", "numba"):
+        engine = "table" if njit is None else "numba"
+    coms = tbl[icol].values.astype("int32")  # Read in comids
+    cols = tbl.columns[1:]  # Get column names that will be accumulated
+    if indices is None and (
+        engine != "sparse"
+        or matrix is None
+        or any(accum_reduction(col) in ("max", "min") for col in cols)
+    ):
+        indices = swapper(coms, upstream)  # Get indices that will be used to map values
+    del upstream  # a and indices are big - clean up to minimize RAM
+    if engine == "sparse" and matrix is None:
+        matrix = upstream_matrix(len(comids), indices, offsets)
+    if engine == "table":
+        up, ws = accum_table(tbl, indices, offsets)
+    elif engine == "numba":
+        up, ws = accum_numba(tbl, indices, offsets)
+    elif engine == "sparse":
+        up, ws = accum_table(tbl, indices, offsets, matrix=matrix)
+    else:
+        # one joblib task per column
+        accum_results = Parallel(n_jobs=-1)(
+            delayed(accum_values)(index, column, tbl, indices, offsets) for index, column in enumerate(cols)
+        )
+        up = np.column_stack([col_up for _, col_up, _ in accum_results])
+        ws = np.column_stack([col_ws for _, _, col_ws in accum_results])
+    return (
+        accum_frame(up, comids, coms, cols, "UpCat", icol),
+        accum_frame(ws, comids, coms, cols, "Ws", icol),
+    )
+
+
+def Accumulation(
+    tbl, comids, offsets, upstream, tbl_type, icol="COMID", engine="auto", matrix=None
+):
+    """
+    __author__ =  "Ryan Hill <hill.ryan@epa.gov>"
+                  "Marc Weber <weber.marc@epa.gov>"
+                  
+    Uses the 'Cat' and 'UpCat' columns to caluculate watershed values and returns those values in 'Cat' columns
+        so they can be appended to 'CatResult' tables in other zones before accumulation.
+    Use `AccumulateUpWs` when both tables are needed.
+
+    Arguments
+    ---------
+    tbl                   : table containing watershed values
+    comids                : numpy array of all zones comids
+    offsets               : numpy array of start positions in `upstream` for each COMID, len(comids) + 1 long
+    upstream              : numpy array of all upstream arrays for each COMID
+    tbl_type              : string value of table metrics to be returned
+    icol                  : column in arr object to index
+    engine                : 'table' to reduce all columns in one pass, 'sparse' to use the upstream
+                            incidence matrix for additive columns, 'numba' for the parallel compiled
+                            kernel, 'column' for one joblib task per column. 'auto' picks 'numba' and
+                            falls back to 'table' when numba isn't installed, as does 'numba'
+    matrix                : cached upstream incidence matrix for the 'sparse' engine, see `load_upstream_matrix`
+    """
+    up, ws = AccumulateUpWs(tbl, comids, offsets, upstream, icol, engine, matrix)
+    return up if tbl_type == "Up" else ws
+
+
+##############################################################################
+
+
+# rasterio datasets can't be shared between threads, each worker of a
+# `RasterPool` keeps its own handles open for the life of the pool
+_datasets = threading.local()
+
+
+class RasterPool(ThreadPoolExecutor):
+    """
+    ThreadPoolExecutor whose workers open rasters with `thread_dataset`. Every
+    handle opened by its workers is closed when the pool shuts down.
+
+    Arguments
+    ---------
+    max_workers     : number of worker threads, defaults to ThreadPoolExecutor's
+    """
+
+    def __init__(self, max_workers=None):
+        super().__init__(max_workers, initializer=self._start_worker)
+        self._handles = []
+        self._lock = threading.Lock()
+
+    def _start_worker(self):
+        _datasets.open = {}
+        _datasets.pool = self
+
+    def _track(self, src):
+        with self._lock:
+            self._handles.append(src)
+
+    def shutdown(self, wait=True, **kwargs):
+        super().shutdown(wait, **kwargs)
+        if wait:
+            with self._lock:
+                handles, self._handles = self._handles, []
+            for src in handles:
+                src.close()
+
+
+def thread_dataset(path):
+    """
+    Returns a rasterio dataset for `path` that is private to the calling
+    `RasterPool` worker, opened on first use. A `ZoneRuns` index is returned
+    as is. Other threads open their rasters with `open_raster`.
+    """
+    if isinstance(path, ZoneRuns):
+        return path
+    if getattr(_datasets, "open", None) is None:
+        raise RuntimeError(
+            f"{path} is opened outside of a RasterPool worker, use open_raster"
+        )
+    if path not in _datasets.open:
+        src = rasterio.open(path)
+        _datasets.pool._track(src)
+        _datasets.open[path] = src
+    return _datasets.open[path]
+
+
+def open_raster(path):
+    """
+    Opens `path` with rasterio in the calling thread as a context manager, a
+    `ZoneRuns` index is returned as is.
+    """
+    return nullcontext(path) if isinstance(path, ZoneRuns) else rasterio.open(path)
+
+
+def raster_windows(height, width, block_size=1024):
+    """
+    Yields square windows covering a raster of `height` rows and `width`
+    columns, row-major, trimmed at the right and bottom edges.
+    """
+    for row in range(0, height, block_size):
+        for col in range(0, width, block_size):
+            yield Window(
+                col, row, min(block_size, width - col), min(block_size, height - row)
+            )
+
+
+def read_aligned(src, zone_src, window, fill=None, indexes=1):
+    """
+    Reads the cells of `src` under `window` of the zone grid and returns them
+    on the zone grid, each zone cell takes the `src` cell holding its centre
+    when the cell sizes or origins differ. Cells outside of `src` are filled
+    with its nodata value.
+
+    Arguments
+    ---------
+    src                   : open rasterio dataset of the landscape layer
+    zone_src              : open rasterio dataset of the zone grid
+    window                : Window of the zone grid to read
+    fill                  : value for cells outside of `src`, defaults to its nodata
+    indexes               : band number, or list of band numbers for a 3D array
+    """
+    if src.crs != zone_src.crs:
+        raise ValueError(
+            f"{src.name} is in {src.crs}, not in {zone_src.crs} of the zone grid"
+        )
+    height, width = int(window.height), int(window.width)
+    zt, st = zone_src.transform, src.transform
+    # row and column of `src` under the centre of each zone row and column
+    x = zt.c + zt.a * (window.col_off + np.arange(width) + 0.5)
+    y = zt.f + zt.e * (window.row_off + np.arange(height) + 0.5)
+    cols = np.floor((x - st.c) / st.a).astype(np.int64)
+    rows = np.floor((y - st.f) / st.e).astype(np.int64)
+    r0, c0 = rows.min(), cols.min()
+    win = Window(c0, r0, cols.max() + 1 - c0, rows.max() + 1 - r0)
+    inside = (
+        c0 >= 0
+        and r0 >= 0
+        and win.col_off + win.width <= src.width
+        and win.row_off + win.height <= src.height
+    )
+    if fill is None:
+        fill = src.nodata if src.nodata is not None else 0
+    if inside:
+        block = src.read(indexes, window=win)
+    else:
+        block = src.read(indexes, window=win, boundless=True, fill_value=fill)
+    if np.array_equal(rows, r0 + np.arange(height)) and np.array_equal(
+        cols, c0 + np.arange(width)
+    ):
+        return block  # the grids are aligned, one cell of `src` per zone cell
+    return block[..., rows[:, None] - r0, cols - c0]
+
+
+def overlaps(a, b):
+    """
+    Returns whether two (left, bottom, right, top) bounds share any area.
+    """
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def valid_cells(values, nodata):
+    """
+    Returns a boolean array of the cells in `values` that hold data.
+    """
+    valid = np.ones(values.shape, dtype=bool)
+    if nodata is not None and not np.isnan(nodata):
+        valid &= values != nodata
+    if values.dtype.kind == "f":
+        valid &= ~np.isnan(values)
+    return valid
+
+
+def continuous_block(zones, values, valid):
+    """
+    Reduces the values of one block by zone with bincounts.
+
+    Arguments
+    ---------
+    zones                 : 1D int array of zone codes of the cells inside a zone
+    values                : 1D array of layer values for the same cells
+    valid                 : 1D boolean array of the cells where the layer has data
+
+    Returns
+    ---------
+    tuple
+        (codes, {stat: array}) for the codes with data in the block, or None
+    """
+    zones, values = zones[valid], values[valid]
+    if not zones.size:
+        return None
+    top = zones.max() + 1
+    values = values.astype(np.float64)
+    count = np.bincount(zones, minlength=top)
+    codes = np.flatnonzero(count)
+    low = np.full(top, np.inf)
+    high = np.full(top, -np.inf)
+    np.minimum.at(low, zones, values)
+    np.maximum.at(high, zones, values)
+    return codes, {
+        "COUNT": count[codes],
+        "SUM": np.bincount(zones, weights=values, minlength=top)[codes],
+        "SUMSQ": np.bincount(zones, weights=values * values, minlength=top)[codes],
+        "MIN": low[codes],
+        "MAX": high[codes],
+    }
+
+
+def weighted_block(zones, values, valid, weights):
+    """
+    Reduces the weighted values of one block by zone with bincounts, the
+    weights are a second raster read over the same cells, 0 where it has no
+    data.
+
+    Returns
+    ---------
+    tuple
+        (codes, {"WSUM": sum of weight * value, "WEIGHT": sum of weights}), or None
+    """
+    zones, values = zones[valid], values[valid].astype(np.float64)
+    weights = weights[valid].astype(np.float64)
+    if not zones.size:
+        return None
+    codes, inv = np.unique(zones, return_inverse=True)
+    return codes, {
+        "WSUM": np.bincount(inv, weights=weights * values, minlength=len(codes)),
+        "WEIGHT": np.bincount(inv, weights=weights, minlength=len(codes)),
+    }
+
+
+def histogram_block(zones, values, valid, edges):
+    """
+    Counts the values of one block into the fixed bins of `edges` by zone with
+    a single bincount over `zone * nbins + bin`, values past either end fall
+    in the end bins. The counts are a mergeable sketch, blocks, catchments and
+    watersheds combine by addition.
+    """
+    zones, values = zones[valid], values[valid]
+    if not zones.size:
+        return None
+    nbins = len(edges) - 1
+    bins = np.searchsorted(edges, values, side="right").clip(1, nbins) - 1
+    codes, inv = np.unique(zones, return_inverse=True)
+    hist = np.bincount(inv * nbins + bins, minlength=len(codes) * nbins)
+    return codes, {"HIST": hist.reshape(len(codes), nbins)}
+
+
+def cells_block(zones, values, valid):
+    """
+    Counts the cells of one block where the layer holds data by zone, used
+    for the cells of a mask inside each catchment.
+    """
+    zones = zones[valid]
+    if not zones.size:
+        return None
+    count = np.bincount(zones)
+    codes = np.flatnonzero(count)
+    return codes, {"COUNT": count[codes]}
+
+
+# bins of the histogram sketches kept for percentiles, see `histogram_block`
+HIST_BINS = 100
+
+
+# how each statistic of a block combines with the running total, and the
+# value a zone starts at before any block has been merged
+ZONAL_MERGE = {"MIN": (np.minimum, np.inf), "MAX": (np.maximum, -np.inf)}
+
+
+def categorical_block(zones, values, valid, classes):
+    """
+    Counts the cells of each class in each zone of one block with a single
+    bincount over `zone * nclasses + class`, zones are renumbered within the
+    block so the count matrix only spans the zones it holds.
+
+    Arguments
+    ---------
+    zones                 : 1D int array of zone codes of the cells inside a zone
+    values                : 1D array of layer values for the same cells
+    valid                 : 1D boolean array of the cells where the layer has data
+    classes               : sorted array of the class values of the layer
+
+    Returns
+    ---------
+    tuple
+        (codes, {"ZONE": cells per zone, "TAB": zone x class counts})
+    """
+    codes, inv = np.unique(zones, return_inverse=True)
+    cls = np.searchsorted(classes, values).clip(0, len(classes) - 1)
+    keep = valid & (classes[cls] == values)
+    ncls = len(classes)
+    tab = np.bincount(
+        inv[keep] * ncls + cls[keep], minlength=len(codes) * ncls
+    ).reshape(len(codes), ncls)
+    return codes, {"ZONE": np.bincount(inv, minlength=len(codes)), "TAB": tab}
+
+
+def merge_zonal(total, part):
+    """
+    Merges the block statistics from `continuous_block` or
+    `categorical_block` into `total`, a dict
+    of arrays indexed by zone code that grow as larger codes are found.
+    """
+    codes, stats = part
+    top = codes[-1] + 1
+    for name, arr in stats.items():
+        func, fill = ZONAL_MERGE.get(name, (np.add, 0))
+        cur = total.get(name)
+        if cur is None or len(cur) < top:
+            grown = np.full((top,) + arr.shape[1:], fill, dtype=arr.dtype)
+            if cur is not None:
+                grown[: len(cur)] = cur
+            total[name] = cur = grown
+        cur[codes] = func(cur[codes], arr)
+    return total
+
+
+def continuous_frame(total, cell_area):
+    """
+    Builds the table that ZonalStatisticsAsTable writes with the "ALL"
+    statistics from the merged zone statistics.
+    """
+    count = total.get("COUNT", np.zeros(0, dtype=np.int64))
+    codes = np.flatnonzero(count)
+    if not codes.size:
+        return pd.DataFrame(
+            columns=["VALUE", "COUNT", "AREA", "MIN", "MAX", "RANGE", "MEAN", "STD", "SUM"]
+        )
+    count = count[codes]
+    total_sum = total["SUM"][codes]
+    mean = total_sum / count
+    var = np.maximum(total["SUMSQ"][codes] / count - mean * mean, 0)
+    low, high = total["MIN"][codes], total["MAX"][codes]
+    return pd.DataFrame(
+        {
+            "VALUE": codes,
+            "COUNT": count,
+            "AREA": count * cell_area,
+            "MIN": low,
+            "MAX": high,
+            "RANGE": high - low,
+            "MEAN": mean,
+            "STD": np.sqrt(var),
+            "SUM": total_sum,
+        }
+    )
+
+
+def categorical_frame(total, classes, cell_area):
+    """
+    Builds the table that TabulateArea writes from the merged zone x class
+    counts, one VALUE_<class> column of area in square metres per class.
+    """
+    count = total.get("ZONE", np.zeros(0, dtype=np.int64))
+    codes = np.flatnonzero(count)
+    tab = total.get("TAB", np.zeros((0, len(classes)), dtype=np.int64))[codes]
+    table = pd.DataFrame(tab * cell_area, columns=[f"VALUE_{c}" for c in classes])
+    table.insert(0, "VALUE", codes)
+    return table
+
+
+def file_fingerprint(path):
+    """
+    Returns (size, mtime) of a file, summed over the files of a directory for
+    ESRI grids such as NHDPlusCatchment/cat, used to tell when a cached
+    product is stale.
+    """
+    p = Path(path)
+    files = [f for f in p.rglob("*") if f.is_file()] if p.is_dir() else [p]
+    stats = [f.stat() for f in files]
+    return (
+        sum(s.st_size for s in stats),
+        max((s.st_mtime_ns for s in stats), default=0),
+    )
+
+
+def tile_view(block, tile, fill):
+    """
+    Pads a 2D block out to whole tiles with `fill` and returns it as
+    (tile rows, tile cols, tile * tile).
+    """
+    h, w = block.shape
+    th, tw = -(-h // tile), -(-w // tile)
+    pad = np.full((th * tile, tw * tile), fill, dtype=block.dtype)
+    pad[:h, :w] = block
+    return pad.reshape(th, tile, tw, tile).swapaxes(1, 2).reshape(th, tw, tile * tile)
+
+
+def cells_frame(total, cell_area):
+    """
+    Builds a VALUE, COUNT, AREA table of the cells counted by `cells_block`,
+    the same VALUE and COUNT a mask zone raster's .vat.dbf holds.
+    """
+    count = total.get("COUNT", np.zeros(0, dtype=np.int64))
+    codes = np.flatnonzero(count)
+    return pd.DataFrame(
+        {"VALUE": codes, "COUNT": count[codes], "AREA": count[codes] * cell_area}
+    )
+
+
+def weighted_frame(total):
+    """
+    Builds a VALUE, WSUM, WEIGHT table from `weighted_block` statistics for
+    every zone with weight.
+    """
+    weight = total.get("WEIGHT", np.zeros(0))
+    codes = np.flatnonzero(weight)
+    wsum = total.get("WSUM", np.zeros(0))
+    return pd.DataFrame({"VALUE": codes, "WSUM": wsum[codes], "WEIGHT": weight[codes]})
+
+
+def histogram_frame(total, nbins):
+    """
+    Builds a VALUE, HIST_0 ... HIST_<nbins - 1> table of the bin counts from
+    `histogram_block` for every zone with data.
+    """
+    hist = total.get("HIST", np.zeros((0, nbins), dtype=np.int64))
+    codes = np.flatnonzero(hist.sum(axis=1))
+    table = pd.DataFrame(hist[codes], columns=[f"HIST_{i}" for i in range(nbins)])
+    table.insert(0, "VALUE", codes)
+    return table
+
+
+def histogram_edges(layer, band=1, bins=HIST_BINS):
+    """
+    Returns the `bins` + 1 evenly spaced bin edges spanning the values of a
+    landscape layer, from GDAL's approximate min and max so every zone and
+    run gets the same bins for a layer.
+    """
+    ds = gdal.Open(layer)
+    low, high = ds.GetRasterBand(band).ComputeRasterMinMax(True)
+    ds = None
+    if high <= low:
+        high = low + 1
+    return np.linspace(low, high, bins + 1)
+
+
+def metric_edges(out_dir, metric, layer):
+    """
+    Returns the bin edges of a metric's histogram columns, computed with
+    `histogram_edges` the first time and kept as `{out_dir}/{metric}_edges.npy`
+    beside its tables, so the zonal tables of every zone and their
+    accumulation all use the same bins.
+    """
+    path = f"{out_dir}/{metric}_edges.npy"
+    if os.path.exists(path):
+        return np.load(path)
+    edges = histogram_edges(layer)
+    np.save(f"{path}.tmp.npy", edges)
+    os.replace(f"{path}.tmp.npy", path)
+    return edges
+
+
+def hist_percentiles(counts, edges, percentiles):
+    """
+    Interpolates percentiles from fixed-bin histograms, the value where the
+    cumulative count crosses each percentile assuming values are spread
+    evenly within their bin.
+
+    Arguments
+    ---------
+    counts                : numpy array of bin counts, (n, nbins)
+    edges                 : numpy array of the nbins + 1 bin edges
+    percentiles           : list of percentiles in [0, 100]
+
+    Returns
+    ---------
+    numpy array
+        (n, len(percentiles)), NaN for rows without any counts
+    """
+    counts = np.nan_to_num(np.asarray(counts, dtype=float))
+    cum = np.cumsum(counts, axis=1)
+    total = cum[:, -1]
+    target = total[:, None] * (np.asarray(percentiles, dtype=float) / 100)
+    # first bin where the cumulative count reaches the target
+    k = (cum[:, None, :] < target[:, :, None]).sum(axis=2).clip(0, len(edges) - 2)
+    rows = np.arange(len(counts))[:, None]
+    below = np.where(k > 0, cum[rows, k - 1], 0)
+    inbin = counts[rows, k]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = np.where(inbin > 0, (target - below) / inbin, 0).clip(0, 1)
+    out = edges[k] + frac * (edges[k + 1] - edges[k])
+    out[total == 0] = np.nan
+    return out
+
+
+def _index_window(zone_raster, window, layers, tile):
+    zone_src = thread_dataset(zone_raster)
+    zones = zone_src.read(1, window=window).astype(np.int64)
+    zones[~(valid_cells(zones, zone_src.nodata) & (zones >= 0))] = -1
+    zt = tile_view(zones, tile, -2)  # -2 pads past the raster edge
+    real = zt != -2
+    low = np.where(real, zt, np.iinfo(np.int64).max).min(axis=2)
+    high = zt.max(axis=2)
+    # zone code of tiles wholly in one zone, -1 boundary, -2 outside all zones
+    codes = np.full(low.shape, -1, dtype=np.int32)
+    codes[low == high] = low[low == high]
+    codes[high < 0] = -2
+    uniform = np.flatnonzero(codes.ravel() >= 0)
+    real = real.reshape(-1, tile * tile)[uniform]
+    # a tile holds at most tile * tile cells, uint16 for the default tile
+    count = np.min_scalar_type(tile * tile)
+    hists = []
+    for path, band, classes in layers:
+        if not uniform.size:
+            hists.append(np.zeros((0, len(classes)), dtype=count))
+            continue
+        src = thread_dataset(path)
+        values = read_aligned(src, zone_src, window, indexes=band)
+        values = tile_view(values, tile, values.dtype.type(0))
+        values = values.reshape(-1, tile * tile)[uniform]
+        cls = np.searchsorted(classes, values).clip(0, len(classes) - 1)
+        keep = real & valid_cells(values, src.nodatavals[band - 1])
+        keep &= classes[cls] == values
+        rows = np.broadcast_to(np.arange(len(uniform))[:, None], values.shape)
+        ncls = len(classes)
+        hists.append(
+            np.bincount(rows[keep] * ncls + cls[keep], minlength=len(uniform) * ncls)
+            .reshape(len(uniform), ncls)
+            .astype(count)
+        )
+    return codes, uniform, hists, real.sum(axis=1).astype(count)
+
+
+def build_hist_index(zone_raster, layers, tile=16, block_size=1024, n_jobs=None):
+    """
+    Builds the block-histogram index of categorical layers on a zone grid in
+    one pass. The zone grid is cut into `tile` x `tile` tiles, each tile is
+    flagged as wholly inside one zone, on a zone boundary or outside of all
+    zones, and the class histogram of every layer is stored for the tiles
+    wholly inside a zone.
+
+    Arguments
+    ---------
+    zone_raster           : string to the zone grid
+    layers                : list of (path, band, classes) for each categorical layer
+    tile                  : rows and columns of zone grid per tile, must divide block_size
+
+    Returns
+    ---------
+    tuple
+        (tile codes of the zone grid, [(uniform tile histograms, cells per uniform tile)
+        for each layer]) with the uniform tiles in row-major order
+    """
+    with open_raster(zone_raster) as zone_src:
+        height, width = zone_src.height, zone_src.width
+    windows = list(raster_windows(height, width, block_size))
+    codes = np.full((-(-height // tile), -(-width // tile)), -2, dtype=np.int32)
+    flat, hists, cells = [], [[] for _ in layers], []
+    with RasterPool(n_jobs) as pool:
+        futures = {
+            pool.submit(_index_window, zone_raster, w, layers, tile): w for w in windows
+        }
+        for future in as_completed(futures):
+            w = futures[future]
+            sub, uniform, parts, ncells = future.result()
+            r0, c0 = w.row_off // tile, w.col_off // tile
+            codes[r0 : r0 + sub.shape[0], c0 : c0 + sub.shape[1]] = sub
+            row, col = np.divmod(uniform, sub.shape[1])
+            flat.append((row + r0) * codes.shape[1] + col + c0)
+            cells.append(ncells)
+            for hist, part in zip(hists, parts):
+                hist.append(part)
+    order = np.argsort(np.concatenate(flat), kind="stable")
+    cells = np.concatenate(cells)[order]
+    return codes, [(np.concatenate(h)[order], cells) for h in hists]
+
+
+def load_hist_index(
+    zone_raster, layers, index_dir, tile=16, block_size=1024, n_jobs=None
+):
+    """
+    Returns the block-histogram index of each layer on the zone grid, read
+    from `index_dir` when an index with the same fingerprint of the zone grid,
+    layer, tile and classes is stored there, otherwise the missing ones are
+    built together in one pass with `build_hist_index` and saved as npz.
+    The tile codes are shared by the layers and stored once per zone grid.
+
+    Arguments
+    ---------
+    zone_raster           : string to the zone grid
+    layers                : list of (path, band, classes) for each categorical layer
+    index_dir             : directory holding the index files
+
+    Returns
+    ---------
+    tuple
+        (tile codes of the zone grid, [(uniform tile histograms, cells per uniform tile)
+        for each layer])
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    zone_key = file_fingerprint(getattr(zone_raster, "name", zone_raster))
+    digest = hashlib.sha1(repr((zone_key, tile)).encode()).hexdigest()[:16]
+    codes_file = f"{index_dir}/codes_{digest}.npz"
+    files = []
+    for path, band, classes in layers:
+        key = repr((zone_key, file_fingerprint(path), band, tile, list(classes)))
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        files.append(f"{index_dir}/{Path(path).stem}_{digest}.npz")
+    todo = [i for i, f in enumerate(files) if not os.path.exists(f)]
+    if not os.path.exists(codes_file):
+        todo = list(range(len(files)))
+    codes, found = None, {}
+    if todo:
+        codes, built = build_hist_index(
+            zone_raster, [layers[i] for i in todo], tile, block_size, n_jobs
+        )
+        for i, (hist, cells) in zip(todo, built):
+            tmp = files[i] + ".tmp.npz"
+            np.savez(tmp, hist=hist, cells=cells)
+            os.replace(tmp, files[i])
+            found[i] = hist, cells
+        if not os.path.exists(codes_file):
+            np.savez(codes_file + ".tmp.npz", codes=codes)
+            os.replace(codes_file + ".tmp.npz", codes_file)
+    else:
+        with np.load(codes_file) as npz:
+            codes = npz["codes"]
+    for i, f in enumerate(files):
+        if i not in found:
+            with np.load(f) as npz:
+                found[i] = npz["hist"], npz["cells"]
+    return codes, [found[i] for i in range(len(files))]
+
+
+def uniform_part(codes, hist, cells):
+    """
+    Sums the stored histograms of the uniform tiles by zone into block
+    statistics that `merge_zonal` can add to a `categorical_block` total.
+    """
+    tile_codes = codes.ravel()
+    tile_codes = tile_codes[tile_codes >= 0]
+    if not tile_codes.size:
+        return None
+    zones, inv = np.unique(tile_codes, return_inverse=True)
+    tab = np.zeros((len(zones), hist.shape[1]), dtype=np.int64)
+    np.add.at(tab, inv, hist)
+    return zones, {
+        "ZONE": np.bincount(inv, weights=cells, minlength=len(zones)).astype(np.int64),
+        "TAB": tab,
+    }
+
+
+def _zonal_window(zone_raster, window, layers, scan=None, indexed=()):
+    zone_src = thread_dataset(zone_raster)
+    zones = zone_src.read(1, window=window)
+    inzone = valid_cells(zones, zone_src.nodata) & (zones >= 0)
+    if scan is not None:
+        # indexed layers only see the cells of boundary tiles, the rest of
+        # their cells come from the index
+        tile, boundary = scan
+        cells = np.repeat(np.repeat(boundary, tile, axis=0), tile, axis=1)
+        boundary = cells[: zones.shape[0], : zones.shape[1]][inzone]
+        if all(indexed):
+            inzone[inzone] = boundary
+            scan = None
+    if not inzone.any():
+        return None
+    # each file is read once for all of the bands requested from it and
+    # each mask once for all of the layers summarized under it
+    bands = defaultdict(set)
+    for path, band, _, _, mask, weight in layers:
+        bands[path].add(band)
+        for extra in (mask, weight):
+            if extra is not None:
+                bands[extra].add(1)
+    cells = {}
+    bounds = zone_src.window_bounds(window)
+    for path, idx in bands.items():
+        src = thread_dataset(path)
+        if not overlaps(src.bounds, bounds):
+            continue  # i.e. an RPU tile elsewhere in the zone, no data here
+        idx = sorted(idx)
+        block = read_aligned(src, zone_src, window, indexes=idx)
+        for band, values in zip(idx, block):
+            values = values[inzone]
+            cells[path, band] = values, valid_cells(values, src.nodatavals[band - 1])
+    zones = zones[inzone].astype(np.int64)
+    parts = []
+    for i, (path, band, reduce, args, mask, weight) in enumerate(layers):
+        if (path, band) not in cells or any(
+            extra is not None and (extra, 1) not in cells for extra in (mask, weight)
+        ):
+            parts.append(None)
+            continue
+        values, valid = cells[path, band]
+        weights = ()
+        if weight is not None:
+            # cells without a weight count for nothing
+            w, wvalid = cells[weight, 1]
+            weights = (np.where(wvalid, w, 0),)
+        keep = boundary if scan is not None and indexed[i] else None
+        if mask is not None:
+            # any cell of the mask holding data is inside it
+            inmask = cells[mask, 1][1]
+            keep = inmask if keep is None else keep & inmask
+        if keep is None:
+            parts.append(reduce(zones, values, valid, *args, *weights))
+        elif keep.any():
+            parts.append(
+                reduce(
+                    zones[keep],
+                    values[keep],
+                    valid[keep],
+                    *args,
+                    *(w[keep] for w in weights),
+                )
+            )
+        else:
+            parts.append(None)
+    return parts
+
+
+def run_zonal(
+    zone_raster, layers, block_size=1024, n_jobs=None, tiles=None, indexed=None
+):
+    """
+    Runs the block reductions of every layer over the block windows of the
+    zone grid in a thread pool, each zone grid block is read once for all of
+    the layers, and merges the block statistics as they finish. With `tiles`
+    the `indexed` layers only scan the cells of boundary tiles, and windows
+    without any are not read at all when every layer is indexed.
+
+    Arguments
+    ---------
+    zone_raster           : string to the zone grid
+    layers                : list of (path, band, reduce, args, mask, weight) for each layer,
+                            mask is the path of a raster limiting the cells reduced and
+                            weight of a raster whose values are passed to reduce after
+                            args, or None
+    block_size            : rows and columns of zone grid read per block
+    n_jobs                : number of block workers, defaults to ThreadPoolExecutor's
+    tiles                 : (tile, tile codes) of a block-histogram index, see `load_hist_index`
+    indexed               : list of booleans, the layers the index covers, defaults to all
+
+    Returns
+    ---------
+    tuple
+        (list of merged statistics by zone code for each layer, area of a zone grid cell)
+    """
+    with open_raster(zone_raster) as zone_src:
+        windows = list(raster_windows(zone_src.height, zone_src.width, block_size))
+        cell_area = abs(zone_src.res[0] * zone_src.res[1])
+        window_bounds = [zone_src.window_bounds(w) for w in windows]
+    scans = [None] * len(windows)
+    if indexed is None:
+        indexed = [tiles is not None] * len(layers)
+    if tiles is not None:
+        tile, codes = tiles
+        scans = []
+        for w in windows:
+            r0, c0 = w.row_off // tile, w.col_off // tile
+            sub = codes[
+                r0 : r0 + -(-w.height // tile), c0 : c0 + -(-w.width // tile)
+            ]
+            if all(indexed) and not (sub == -1).any():
+                scans.append(False)  # every cell is in the index
+            else:
+                scans.append((tile, sub == -1))
+    # windows outside of every layer are not read at all
+    extents = []
+    for path in {spec[0] for spec in layers}:
+        with rasterio.open(path) as src:
+            extents.append(src.bounds)
+    for i, bounds in enumerate(window_bounds):
+        if not any(overlaps(extent, bounds) for extent in extents):
+            scans[i] = False
+    totals = [{} for _ in layers]
+    with RasterPool(n_jobs) as pool:
+        futures = [
+            pool.submit(_zonal_window, zone_raster, w, layers, scan, indexed)
+            for w, scan in zip(windows, scans)
+            if scan is not False
+        ]
+        for future in as_completed(futures):
+            parts = future.result()
+            if parts is None:
+                continue
+            for total, part in zip(totals, parts):
+                if part is not None:
+                    merge_zonal(total, part)
+    return totals, cell_area
+
+
+def zonal_tables(
+    zone_raster, layers, block_size=1024, n_jobs=None, index_dir=None, tile=16
+):
+    """
+    Computes the zonal statistics of several landscape layers that share a
+    zone grid in a single pass, i.e. the years of NLCD or ForestLossByYear.
+    Each block of the zone grid is read once and each layer's block is read
+    once, bands of a multi-band stack come out of a single read.
+
+    Arguments
+    ---------
+    zone_raster           : string to the zone grid, i.e. the NHD catchment grid or a mask,
+                            or its `ZoneRuns`
+    layers                : list of (layer, accum_type), (layer, accum_type, mask) or
+                            (layer, "Weighted", mask, weight), layer
+                            is a raster path or a (path, band) tuple for one band of a
+                            stack, accum_type is 'Continuous', 'Categorical', 'Mask' to
+                            count the cells of the layer holding data or 'Histogram' for
+                            counts in fixed bins, requested as (layer, "Histogram", mask,
+                            edges) or from `histogram_edges` without edges, mask is the path
+                            of a raster whose cells holding data are the only ones
+                            summarized, so masked and unmasked variants of a layer come
+                            out of the same pass, weight is the path of a weight raster
+                            for the sum of weight * value and the sum of weights
+    block_size            : rows and columns of zone grid read per block
+    n_jobs                : number of block workers, defaults to ThreadPoolExecutor's
+    index_dir             : directory of block-histogram indexes, for Categorical layers
+                            tiles wholly inside a catchment are taken from the index
+                            and only the cells of boundary tiles are scanned
+    tile                  : rows and columns of zone grid per index tile
+
+    Returns
+    ---------
+    list
+        tables in the order of `layers`, as `zonal_stats` or `tabulate_area` return them
+    """
+    specs, kinds = [], []
+    for layer, accum_type, *extra in layers:
+        path, band = layer if isinstance(layer, tuple) else (layer, 1)
+        mask, arg = (extra + [None, None])[:2]
+        if accum_type == "Categorical":
+            cls = np.unique(np.asarray(rat_values(path)))
+            specs.append((path, band, categorical_block, (cls,), mask, None))
+        elif accum_type == "Continuous":
+            specs.append((path, band, continuous_block, (), mask, None))
+        elif accum_type == "Mask":
+            specs.append((path, band, cells_block, (), mask, None))
+        elif accum_type == "Histogram":
+            edges = histogram_edges(path, band) if arg is None else np.asarray(arg)
+            specs.append((path, band, histogram_block, (edges,), mask, None))
+        elif accum_type == "Weighted":
+            specs.append((path, band, weighted_block, (), mask, arg))
+        else:
+            raise ValueError(f"no zonal statistics for accum_type {accum_type!r}")
+        kinds.append(accum_type)
+    # the index holds whole tiles, masked layers scan every cell
+    indexed = [
+        bool(index_dir) and kind == "Categorical" and spec[4] is None
+        for kind, spec in zip(kinds, specs)
+    ]
+    tiles = None
+    if any(indexed):
+        codes, index = load_hist_index(
+            zone_raster,
+            [
+                (path, band, args[0])
+                for (path, band, _, args, _, _), use in zip(specs, indexed)
+                if use
+            ],
+            index_dir,
+            tile,
+            block_size,
+            n_jobs,
+        )
+        tiles = (tile, codes)
+    totals, cell_area = run_zonal(
+        zone_raster, specs, block_size, n_jobs, tiles=tiles, indexed=indexed
+    )
+    if tiles is not None:
+        for total, (hist, cells) in zip(
+            [t for t, use in zip(totals, indexed) if use], index
+        ):
+            part = uniform_part(codes, hist, cells)
+            if part is not None:
+                merge_zonal(total, part)
+    tables = []
+    for total, kind, spec in zip(totals, kinds, specs):
+        if kind == "Categorical":
+            tables.append(categorical_frame(total, spec[3][0], cell_area))
+        elif kind == "Continuous":
+            tables.append(continuous_frame(total, cell_area))
+        elif kind == "Histogram":
+            tables.append(histogram_frame(total, len(spec[3][0]) - 1))
+        elif kind == "Weighted":
+            tables.append(weighted_frame(total))
+        else:
+            tables.append(cells_frame(total, cell_area))
+    return tables
+
+
+def zonal_stats(zone_raster, layer, block_size=1024, n_jobs=None):
+    """
+    Native replacement for arcpy ZonalStatisticsAsTable(..., "DATA", "ALL").
+    Streams block windows of the zone grid and the aligned cells of the
+    landscape layer through a thread pool, reducing each block by zone with
+    bincounts and merging the blocks as they finish.
+
+    Arguments
+    ---------
+    zone_raster           : string to the zone grid, i.e. the NHD catchment grid or a mask,
+                            or its `ZoneRuns`
+    layer                 : string of the landscape raster name
+    block_size            : rows and columns of zone grid read per block
+    n_jobs                : number of block workers, defaults to ThreadPoolExecutor's
+
+    Returns
+    ---------
+    pd.DataFrame
+        VALUE, COUNT, AREA, MIN, MAX, RANGE, MEAN, STD and SUM of every zone with data
+    """
+    totals, cell_area = run_zonal(
+        zone_raster, [(layer, 1, continuous_block, (), None, None)], block_size, n_jobs
+    )
+    return continuous_frame(totals[0], cell_area)
+
+
+def tabulate_area(
+    zone_raster, layer, classes=None, block_size=1024, n_jobs=None, index_dir=None
+):
+    """
+    Native replacement for arcpy TabulateArea. Counts the cells of every
+    class in every zone in one streaming pass over block windows of the
+    zone grid. The class set is taken from the layer's raster attribute
+    table up front, so every class gets a column whether or not it occurs
+    in the zone grid.
+
+    Arguments
+    ---------
+    zone_raster           : string to the zone grid, i.e. the NHD catchment grid or a mask,
+                            or its `ZoneRuns`
+    layer                 : string of the landscape raster name
+    classes               : class values to tabulate, defaults to `rat_values(layer)`
+    block_size            : rows and columns of zone grid read per block
+    n_jobs                : number of block workers, defaults to ThreadPoolExecutor's
+    index_dir             : directory of block-histogram indexes, see `zonal_tables`
+
+    Returns
+    ---------
+    pd.DataFrame
+        VALUE and the area in square metres of each class as VALUE_<class>
+    """
+    if classes is None:
+        return zonal_tables(
+            zone_raster, [(layer, "Categorical")], block_size, n_jobs, index_dir
+        )[0]
+    classes = np.unique(np.asarray(classes))
+    totals, cell_area = run_zonal(
+        zone_raster,
+        [(layer, 1, categorical_block, (classes,), None, None)],
+        block_size,
+        n_jobs,
+    )
+    return categorical_frame(totals[0], classes, cell_area)
+
+
+def zonal_stash(out_dir, LandscapeLayer, appendMetric, zone):
+    """
+    Returns the path in `DBF_stash` of the table arcpy writes with the zonal
+    statistics of a landscape layer for a zone.
+    """
+    if LandscapeLayer.count(".tif") or LandscapeLayer.count(".img"):
+        landscape_layer = Path(LandscapeLayer).stem  # / vs. \ agnostic
+    else:
+        landscape_layer = Path(LandscapeLayer).name  # / vs. \ agnostic
+    return f"{out_dir}/DBF_stash/zonalstats_{landscape_layer}{appendMetric}{zone}.dbf"
+
+
+def stashZonal(zone_raster, layers, cache, index_dir=None):
+    """
+    Returns the zonal statistics of the layers that share a zone grid from
+    the `ZonalCache`, the tables it misses are computed together with one
+    `zonal_tables` pass and added to it.
+
+    Arguments
+    ---------
+    zone_raster           : string to the zone grid, i.e. the NHD catchment grid or a mask,
+                            or its `ZoneRuns`
+    layers                : list of (LandscapeLayer, accum_type) or (LandscapeLayer,
+                            accum_type, mask) for layers summarized within a mask
+                            raster, the mask's cell counts come with them as
+                            (mask, "Mask", None), weighted sums are requested as
+                            (LandscapeLayer, "Weighted", mask, weight raster) and
+                            histograms as (LandscapeLayer, "Histogram", mask, edges)
+                            with a tuple of bin edges
+    cache                 : ZonalCache holding the tables
+    index_dir             : directory of block-histogram indexes, see `zonal_tables`
+
+    Returns
+    ---------
+    dict
+        (LandscapeLayer, accum_type, mask) to table, with the weight raster or
+        bin edges appended when they were requested
+    """
+    specs = []
+    for layer, accum_type, *extra in layers:
+        mask = extra[0] if extra else None
+        specs.append((layer, accum_type, mask, *extra[1:]))
+        if mask is not None:
+            specs.append((mask, "Mask", None))
+    tables, todo = {}, {}
+    for spec in dict.fromkeys(specs):
+        layer, accum_type, mask, *arg = spec
+        stat = accum_type
+        if accum_type == "Histogram":
+            # tables of other bins are different tables
+            stat = (accum_type, tuple(arg[0]) if arg else HIST_BINS)
+        elif arg:
+            stat = (accum_type, str(arg[0]), file_fingerprint(arg[0]))
+        key = cache.key(layer, zone_raster, mask, stat)
+        tables[spec] = cache.get(key)
+        if tables[spec] is None:
+            todo[spec] = key
+    if todo:
+        start = time.time()
+        computed = zonal_tables(zone_raster, list(todo), index_dir=index_dir)
+        seconds = (time.time() - start) / len(todo)
+        for (spec, key), table in zip(todo.items(), computed):
+            cache.put(key, table, seconds, layer=str(spec[0]), stat=spec[1])
+            tables[spec] = table
+    return tables
+
+
+##############################################################################
+
+
+def createCatStats(
+    accum_type,
+    LandscapeLayer,
+    inZoneData,
+    out_dir,
+    zone,
+    by_RPU,
+    mask_dir,
+    NHD_dir,
+    hydroregion,
+    appendMetric,
+    engine="arcpy",
+    sketch=False,
+    weight=None,
+    edges=None,
+):
+
+    """
+    __author__ =  "Marc Weber <weber.marc@epa.gov>"
+                  "Ryan Hill <hill.ryan@epa.gov>"
+    Uses the arcpy tools to perform ZonalStatisticsAsTable or TabulateArea based on accum_type and then formats
+    the results into a Catchment Results table with 'PctFull'Calculated
+
+    Arguments
+    ---------
+    accum_type            : type metric to be accumulated, i.e. 'Categorical', 'Continuous', 'Count'
+    LandscapeLayer        : string of the landscape raster name
+    inZoneData            : string to the NHD catchment grid, the mask zone raster of
+                            masked metrics with the arcpy engine
+    out_dir               : string to directory where output is being stored
+    zone                  : string of an NHDPlusV2 VPU zone, i.e. 10L, 16, 17
+    engine                : "arcpy" for the Spatial Analyst tools or "native" to run
+                            `zonal_tables`, masks in `mask_dir` are then read as boolean
+                            rasters over the catchment grid
+    sketch                : add the fixed-bin histogram of a Continuous layer in each
+                            catchment as CatHist<bin> columns, accumulated like sums and
+                            turned into percentiles by `sketch_percentiles`
+    weight                : (name, source) of a weighting surface for a Continuous layer,
+                            source is a weight raster or "<table>:<FIELD>" of weights by
+                            COMID, a .dbf or .csv relative to the VPU directory, i.e.
+                            "NHDPlusAttributes/elevslope.dbf:SLOPE". Adds Cat<name>, the
+                            sum of weight * value, and Cat<name>Weight, the sum of weights,
+                            accumulated like sums until `weighted_means` divides them
+    edges                 : bin edges of the histogram columns, see `metric_edges`,
+                            from `histogram_edges` when None
+    """
+
+    if engine not in ("arcpy", "native"):
+        raise ValueError(f"unknown zonal engine {engine!r}")
+    cache = ZonalCache(f"{out_dir}/DBF_stash/zonal_cache")
+    # masks are read as an extra input over the catchment grid
+    mask = f"{mask_dir}/{zone}.tif" if mask_dir and engine == "native" else None
+    sketch = sketch and accum_type == "Continuous" and by_RPU == 0
+    if sketch:
+        if edges is None:
+            edges = histogram_edges(LandscapeLayer)
+        hist_spec = (LandscapeLayer, "Histogram", mask, tuple(edges))
+    if weight is not None and (accum_type != "Continuous" or by_RPU == 1):
+        raise ValueError("weights apply to Continuous layers summarized by catchment")
+    vpu_dir = f"{NHD_dir}/NHDPlus{hydroregion}/NHDPlus{zone}"
+    by_comid = weight is not None and re.match(r"(.+\.(?:dbf|csv)):(\w+)$", weight[1])
+    weighted = weight is not None and not by_comid
+    try:
+        if arcpy is not None:
+            arcpy.env.cellSize = "30"
+            arcpy.env.snapRaster = inZoneData
+        if by_RPU == 0:
+            outTable = zonal_stash(out_dir, LandscapeLayer, appendMetric, zone)
+            if engine == "native":
+                specs = [(LandscapeLayer, accum_type, mask)]
+                if sketch:
+                    specs.append(hist_spec)
+                if weighted:
+                    specs.append((LandscapeLayer, "Weighted", mask, weight[1]))
+                tables = stashZonal(inZoneData, specs, cache)
+                table = tables[LandscapeLayer, accum_type, mask]
+            else:
+                key = cache.key(LandscapeLayer, inZoneData, None, accum_type)
+                table = cache.get(key)
+            if table is None:
+                # a DBF older than the layer or zone grid it came from is stale
+                if os.path.exists(outTable) and os.path.getmtime(outTable) * 1e9 < max(
+                    file_fingerprint(LandscapeLayer)[1], file_fingerprint(inZoneData)[1]
+                ):
+                    os.remove(outTable)
                 if not os.path.exists(outTable):
-                    ZonalStatisticsAsTable(
-                        inZoneData, "VALUE", elev, outTable, "DATA", "ALL"
-                    )
-            for count, rpu in enumerate(rpuList):
-                if count == 0:
-                    table = dbf2DF(f"{out_dir}/DBF_stash/zonalstats_elev{rpu}.dbf")
-                else:
-                    table = pd.concat(
-                        [
-                            table,
-                            dbf2DF(f"{out_dir}/DBF_stash/zonalstats_elev{rpu}.dbf"),
-                        ]
-                    )
-            if len(rpuList) > 1:
-                table.reset_index(drop=True, inplace=True)
-                table = table.loc[table.groupby("VALUE").AREA.idxmax()]
+                    if accum_type == "Categorical":
+                        TabulateArea(
+                            inZoneData, "VALUE", LandscapeLayer, "Value", outTable, "30"
+                        )
+                    if accum_type == "Continuous":
+                        ZonalStatisticsAsTable(
+                            inZoneData, "VALUE", LandscapeLayer, outTable, "DATA", "ALL"
+                        )
+                start = time.time()
+                try:
+                    table = dbf2DF(outTable)
+                except fiona.errors.DriverError as e:
+                    # arc occassionally doesn't release the file and fails here
+                    print(e, "\n\n!EXCEPTION CAUGHT! TRYING AGAIN!")
+                    time.sleep(60)
+                    start = time.time()
+                    table = dbf2DF(outTable)
+                # the cache keeps the read time so hits can report what they saved
+                cache.put(
+                    key, table, time.time() - start, layer=LandscapeLayer, stat=accum_type
+                )
+        if by_RPU == 1:
+            hydrodir = "/".join(inZoneData.split("/")[:-2]) + "/NEDSnapshot"
+            rpus = {
+                subdirs[-3:]: f"{hydrodir}/{subdirs}/elev_cm"
+                for subdirs in os.listdir(hydrodir)
+            }
+            if engine == "native":
+                # one pass over the zone grid for every RPU tile, each block
+                # only reads the tiles it overlaps
+                tables = stashZonal(
+                    inZoneData, [(elev, "Continuous") for elev in rpus.values()], cache
+                )
+                tables = [tables[elev, "Continuous", None] for elev in rpus.values()]
+            else:
+                for rpu, elev in rpus.items():
+                    print("working on " + elev)
+                    outTable = f"{out_dir}/DBF_stash/zonalstats_elev{rpu}.dbf"
+                    if not os.path.exists(outTable):
+                        ZonalStatisticsAsTable(
+                            inZoneData, "VALUE", elev, outTable, "DATA", "ALL"
+                        )
+                tables = [
+                    dbf2DF(f"{out_dir}/DBF_stash/zonalstats_elev{rpu}.dbf")
+                    for rpu in rpus
+                ]
+            table = pd.concat(tables, ignore_index=True)
+            if len(rpus) > 1:
+                # catchments that span RPUs keep the RPU covering most of them
+                table = table.sort_values(
+                    ["VALUE", "AREA"], ascending=[True, False], kind="stable"
+                ).drop_duplicates("VALUE")
     except LicenseError:
         print("Spatial Analyst license is unavailable")
-    except arcpy.ExecuteError:
+    except arcpy.ExecuteError if arcpy is not None else ():
         print("Failing at the ExecuteError!")
         print(arcpy.GetMessages(2))
 
+    if engine != "native" and (sketch or weighted):
+        # arcpy has neither, they come from `zonal_tables` over the same grid
+        specs = [hist_spec] if sketch else []
+        if weighted:
+            specs.append((LandscapeLayer, "Weighted", None, weight[1]))
+        tables = stashZonal(inZoneData, specs, cache)
     if mask_dir:
-        nhdtbl = dbf2DF(
-            f"{NHD_dir}/NHDPlus{hydroregion}/NHDPlus{zone}"
-            "/NHDPlusCatchment/Catchment.dbf"
-        ).loc[:, ["FEATUREID", "AREASQKM", "GRIDCODE"]]
-        tbl = dbf2DF(outTable)
-        if accum_type == "Categorical":
+        nhdtbl = dbf2DF(f"{vpu_dir}/NHDPlusCatchment/Catchment.dbf").loc[:, ["FEATUREID", "AREASQKM", "GRIDCODE"]]
+        gridcodes = nhdtbl.rename(columns={"FEATUREID": "COMID"})
+        tbl = table
+        if accum_type == "Categorical" and engine == "arcpy":
             tbl = chkColumnLength(tbl, LandscapeLayer)
         # We need to use the raster attribute table here for PctFull & Area
         # TODO: this needs to be considered when making masks!!!
-        tbl2 = dbf2DF(f"{mask_dir}/{zone}.tif.vat.dbf")
+        if engine == "native":
+            tbl2 = tables[mask, "Mask", None][["VALUE", "COUNT"]]
+        else:
+            tbl2 = dbf2DF(f"{mask_dir}/{zone}.tif.vat.dbf")
         tbl2 = (
             pd.merge(tbl2, nhdtbl, how="right", left_on="VALUE", right_on="GRIDCODE")
             .fillna(0)
@@ -1125,7 +3024,8 @@ def createCatStats(
                 table = table[["VALUE", "AREA", "COUNT", "SUM"]]
             table = table.rename(columns={"COUNT": "Count", "SUM": "Sum"})
         if accum_type == "Categorical":
-            table = chkColumnLength(table, LandscapeLayer)
+            if engine == "arcpy":
+                table = chkColumnLength(table, LandscapeLayer)
             table["AREA"] = table[table.columns.tolist()[1:]].sum(axis=1)
         nhdTable = dbf2DF(inZoneData[:-3] + "Catchment.dbf").loc[
             :, ["FEATUREID", "AREASQKM", "GRIDCODE"]
@@ -1133,23 +3033,59 @@ def createCatStats(
         nhdTable = nhdTable.rename(
             columns={"FEATUREID": "COMID", "AREASQKM": "AreaSqKm"}
         )
+        gridcodes = nhdTable
         result = pd.merge(
             nhdTable, table, how="left", left_on="GRIDCODE", right_on="VALUE"
         )
-        if LandscapeLayer.split("/")[-1].split(".")[0] == "rdstcrs":
-            slptbl = dbf2DF(
-                "%s/NHDPlus%s/NHDPlus%s/NHDPlusAttributes/elevslope.dbf"
-                % (NHD_dir, hydroregion, zone)
-            ).loc[:, ["COMID", "SLOPE"]]
-            slptbl.loc[slptbl["SLOPE"] == -9998.0, "SLOPE"] = 0
-            result = pd.merge(result, slptbl, on="COMID", how="left")
-            result.SLOPE = result.SLOPE.fillna(0)
-            result["SlpWtd"] = result["Sum"] * result["SLOPE"]
-            result = result.drop(["SLOPE"], axis=1)
         result["PctFull"] = (
             ((result.AREA * 1e-6) / result.AreaSqKm.astype("float")) * 100
         ).fillna(0)
         result = result.drop(["GRIDCODE", "VALUE", "AREA"], axis=1)
+    if weight is not None:
+        name, source = weight
+        suffix = appendMetric if mask_dir else ""
+        if by_comid:
+            path, field = by_comid.groups()
+            path = path if os.path.isabs(path) else f"{vpu_dir}/{path}"
+            wtbl = dbf2DF(path) if path.endswith(".dbf") else pd.read_csv(path)
+            w = wtbl.set_index("COMID")[field].astype(float)
+            # NHDPlus flags missing attributes with -9998, they weigh nothing
+            w = w.mask(w <= -9998, 0).reindex(result.COMID).fillna(0).values
+            wtd = pd.DataFrame(
+                {
+                    "COMID": result.COMID,
+                    f"{name}{suffix}": result[f"Sum{suffix}"].values * w,
+                    f"{name}Weight{suffix}": result[f"Count{suffix}"].values * w,
+                }
+            )
+        else:
+            wtd = pd.merge(
+                gridcodes[["COMID", "GRIDCODE"]],
+                tables[LandscapeLayer, "Weighted", mask, source],
+                how="left",
+                left_on="GRIDCODE",
+                right_on="VALUE",
+            )[["COMID", "WSUM", "WEIGHT"]]
+            wtd.columns = ["COMID", f"{name}{suffix}", f"{name}Weight{suffix}"]
+        result = pd.merge(result, wtd, on="COMID", how="left")
+    if sketch:
+        # the bins stay additive columns, so they cross VPUs and accumulate
+        # like any Sum until accumulateZone turns them into percentiles
+        hist = pd.merge(
+            gridcodes[["COMID", "GRIDCODE"]],
+            tables[hist_spec],
+            how="left",
+            left_on="GRIDCODE",
+            right_on="VALUE",
+        ).drop(["GRIDCODE", "VALUE"], axis=1)
+        suffix = appendMetric if mask_dir else ""
+        hist.columns = ["COMID"] + [
+            f"Hist{c[5:]}{suffix}" for c in hist.columns[1:]
+        ]
+        result = pd.merge(result, hist.fillna(0), on="COMID", how="left")
+    # PctFull stays the last column
+    pct = result.columns[result.columns.str.startswith("PctFull")].tolist()
+    result = result[result.columns.drop(pct).tolist() + pct]
     cols = result.columns[1:]
     result.columns = np.append("COMID", "Cat" + cols.values)
     return result  # ALL NAs need to be filled w/ zero here for Accumulation!!
@@ -1183,6 +3119,18 @@ def get_rat_vals(raster):
     return df.loc[(df.Opacity > 0) & (df.Histogram > 0)].index.tolist()
 
 
+def rat_values(landscape_layer):
+    """
+    Returns the class values of a categorical landscape layer, read from its
+    ESRI .vat.dbf when there is one, otherwise from the RAT built with GDAL.
+    """
+    rat_file = f"{landscape_layer}.vat.dbf"
+    if not os.path.exists(rat_file):
+        # build RAT with GDAL
+        return get_rat_vals(landscape_layer)
+    return dbf2DF(rat_file).VALUE.tolist()
+
+
 def chkColumnLength(table, landscape_layer):
     """
     Checks the number of columns returned from zonal stats and adds any of the
@@ -1215,12 +3163,7 @@ def chkColumnLength(table, landscape_layer):
     pd.DataFrame
         if any missing VALUEs from landscape_layer else
     """
-    rat_file = f"{landscape_layer}.vat.dbf"
-    if not os.path.exists(rat_file):
-        # build RAT with GDAL
-        rat_cols = get_rat_vals(landscape_layer)
-    else:
-        rat_cols = dbf2DF(rat_file).VALUE.tolist()
+    rat_cols = rat_values(landscape_layer)
     tbl_cols = table.columns.tolist()
     tbl_cols.sort(key=len)  # sort() is done in place on a list -- returns None
     table, val_cols = table[tbl_cols], tbl_cols[1:]
@@ -1235,7 +3178,7 @@ def chkColumnLength(table, landscape_layer):
     return table
 
 
-def appendConnectors(cat, Connector, zone, interVPUtbl):
+def appendConnectors(cat, connectors, zone, interVPUtbl):
     """
     __author__ =  "Marc Weber <weber.marc@epa.gov>"
                   "Ryan Hill <hill.ryan@epa.gov>"
@@ -1244,25 +3187,18 @@ def appendConnectors(cat, Connector, zone, interVPUtbl):
     Arguments
     ---------
     cat                   : Results table of catchment summarization
-    Connector             : string to file holding the table of inter VPU COMIDs
+    connectors            : table of inter VPU COMIDs flowing into the zone, see `ConnectorStore.for_zone`
     zone                  : string of an NHDPlusV2 VPU zone, i.e. 10L, 16, 17
     interVPUtbl           : table of interVPU adjustments
     """
-    con = pd.read_csv(Connector)
-    for comidx in con.COMID.values.astype(int):
-        if comidx in cat.COMID.values.astype(int):
-            cat = cat.drop(cat[cat.COMID == comidx].index)
+    con = connectors
+    to_zone = interVPUtbl.loc[interVPUtbl.ToZone.values == zone]
+    cat = cat.loc[~cat.COMID.isin(con.COMID.values)]
     con = con.loc[
         con.COMID.isin(
             np.append(
-                interVPUtbl.loc[interVPUtbl.ToZone.values == zone].thruCOMIDs.values,
-                interVPUtbl.loc[interVPUtbl.ToZone.values == zone].toCOMIDs.values[
-                    np.nonzero(
-                        interVPUtbl.loc[
-                            interVPUtbl.ToZone.values == zone
-                        ].toCOMIDs.values
-                    )
-                ],
+                to_zone.thruCOMIDs.values,
+                to_zone.toCOMIDs.values[np.nonzero(to_zone.toCOMIDs.values)],
             )
         )
     ]
@@ -1274,6 +3210,234 @@ def appendConnectors(cat, Connector, zone, interVPUtbl):
 ##############################################################################
 
 
+def sketch_percentiles(tbl, edges, percentiles):
+    """
+    Replaces each group of Cat, UpCat and Ws histogram columns from
+    `createCatStats(sketch=True)` with their percentiles, i.e. CatHist0 ...
+    CatHist99 become CatP10, CatP50, CatP90.
+
+    Arguments
+    ---------
+    tbl                   : accumulated results table holding <prefix>Hist<bin><suffix> columns
+    edges                 : numpy array of the bin edges, see `histogram_edges`
+    percentiles           : list of percentiles in [0, 100]
+
+    Returns
+    ---------
+    pandas.DataFrame
+        tbl with <prefix>P<percentile><suffix> columns in place of the histograms
+    """
+    parts = tbl.columns.str.extract(r"^(Cat|UpCat|Ws)Hist(\d+)(.*)$")
+    hist = parts.dropna()
+    for (prefix, suffix), group in hist.groupby([0, 2], sort=False):
+        cols = tbl.columns[group[1].astype(int).sort_values().index]
+        values = hist_percentiles(tbl[cols].to_numpy(), edges, percentiles)
+        for j, q in enumerate(percentiles):
+            tbl[f"{prefix}P{q:g}{suffix}"] = values[:, j]
+    return tbl.drop(columns=tbl.columns[hist.index])
+
+
+def weighted_means(tbl, name):
+    """
+    Replaces each pair of Cat, UpCat and Ws weighted sum and sum of weights
+    columns from `createCatStats(weight=...)` with their weighted mean, i.e.
+    CatSlpWtd and CatSlpWtdWeight become CatSlpWtdMean.
+
+    Arguments
+    ---------
+    tbl                   : accumulated results table holding <prefix><name><suffix> and
+                            <prefix><name>Weight<suffix> columns
+    name                  : name of the weighted metric from the control table
+
+    Returns
+    ---------
+    pandas.DataFrame
+        tbl with <prefix><name>Mean<suffix> columns in place of the sums, NaN
+        where there is no weight
+    """
+    parts = tbl.columns.str.extract(rf"^(Cat|UpCat|Ws){re.escape(name)}Weight(.*)$")
+    drop = []
+    for prefix, suffix in parts.dropna().itertuples(index=False):
+        total, weight = f"{prefix}{name}{suffix}", f"{prefix}{name}Weight{suffix}"
+        # the mean takes the place of the sum
+        tbl.insert(
+            tbl.columns.get_loc(total),
+            f"{prefix}{name}Mean{suffix}",
+            tbl[total] / tbl[weight].where(tbl[weight] > 0),
+        )
+        drop += [total, weight]
+    return tbl.drop(columns=drop)
+
+
+def accumulateZone(
+    zone,
+    tables,
+    interVPUtbl,
+    out_dir,
+    connectors=None,
+    accum_dir="accum_npy",
+    sketches=None,
+    engine="auto",
+    weights=None,
+):
+    """
+    Accumulates every queued metric of a zone against a single load of the
+    zone's topology. The upstream indices are computed once and reused for
+    each metric's cat table, results are still written to each metric's own
+    `{out_dir}/{FullTableName}_{zone}.csv`.
+
+    Arguments
+    ---------
+    zone                  : string of an NHDPlusV2 VPU zone, i.e. 10L, 16, 17
+    tables                : list of (FullTableName, accum_type) tuples from the control table
+    interVPUtbl           : table of interVPU adjustments
+    out_dir               : string to directory where output is being stored
+    connectors            : dict of FullTableName to connector rows flowing into the zone, see `ConnectorStore.for_zone`
+    accum_dir             : directory where the topology is stored
+    sketches              : dict of FullTableName to percentiles for metrics with histogram
+                            columns, their bin edges are read back from `metric_edges`
+    engine                : accumulation engine of `AccumulateUpWs`, 'sparse' loads the
+                            zone's upstream matrix with `load_upstream_matrix`
+    weights               : dict of FullTableName to the name of its weighted sums, see
+                            `weighted_means`
+
+    Returns
+    ---------
+    dict
+        FullTableName to the connector rows this zone passes downstream,
+        empty when the zone isn't a FromZone
+    """
+    connectors = connectors or {}
+    sketches = sketches or {}
+    weights = weights or {}
+    accum = load_accum(zone, accum_dir)
+    comids = accum["comids"]
+    indices = swapper(comids.astype("int32"), accum["upstream"])
+    matrix = load_upstream_matrix(zone, accum_dir) if engine == "sparse" else None
+    from_zone = interVPUtbl.loc[interVPUtbl.FromZone == zone]
+    passed = {}
+    for name, accum_type in tables:
+        fn = f"{out_dir}/{name}_{zone}.csv"
+        local = pd.read_csv(fn)
+        cat = local
+        if zone in interVPUtbl.ToZone.values and name in connectors:
+            cat = appendConnectors(cat, connectors[name], zone, interVPUtbl)
+        cat = cat.astype({"COMID": comids.dtype}).set_index("COMID")
+        cat = cat.loc[comids].reset_index()
+        if zone not in interVPUtbl.ToZone.values:
+            local = cat
+
+        up, ws = AccumulateUpWs(
+            cat,
+            comids,
+            accum["offsets"],
+            accum["upstream"],
+            engine=engine,
+            matrix=matrix,
+            indices=indices,
+        )
+
+        if len(from_zone):
+            passed[name] = interVPU(
+                ws,
+                local.columns[1:],
+                accum_type,
+                zone,
+                f"{out_dir}/{name}_{from_zone.ToZone.values[0]}.csv",
+                interVPUtbl.copy(),
+            )
+        upFinal = pd.merge(up, ws, on="COMID")
+        final = pd.merge(local, upFinal, on="COMID")
+        if name in sketches:
+            # the bins the cat tables were counted in
+            edges = np.load(f"{out_dir}/{name}_edges.npy")
+            final = sketch_percentiles(final, edges, sketches[name])
+        if name in weights:
+            final = weighted_means(final, weights[name])
+        final.to_csv(fn, index=False)
+    return passed
+
+
+def zoneDependencies(interVPUtbl, zones):
+    """
+    Builds the zone dependency graph from the FromZone -> ToZone pairs of the
+    InterVPU table. A zone can only be accumulated after every zone that
+    writes a connector into it.
+
+    Arguments
+    ---------
+    interVPUtbl           : table of interVPU adjustments
+    zones                 : iterable of the NHDPlusV2 VPU zones being run
+
+    Returns
+    ---------
+    dict
+        each zone mapped to the set of zones it waits on
+    """
+    deps = {zone: set() for zone in zones}
+    for from_zone, to_zone in zip(interVPUtbl.FromZone, interVPUtbl.ToZone):
+        if from_zone in deps and to_zone in deps and from_zone != to_zone:
+            deps[to_zone].add(from_zone)
+    return deps
+
+
+def _run_zone(threads, func, zone, *args, **kwargs):
+    """Runs `func` for a zone in a worker limited to `threads` numba threads."""
+    if njit is not None:
+        set_num_threads(threads)
+    return func(zone, *args, **kwargs)
+
+
+def scheduleZones(func, deps, *args, n_jobs=None, zone_kwargs=None):
+    """
+    Runs `func(zone, *args)` for every zone in a process pool, submitting a
+    zone as soon as all the zones it depends on have finished. Independent
+    zones run concurrently, so a full run is bounded by the longest chain of
+    connected zones rather than the sum of all zones. Zones are submitted in
+    the order of `deps` when several are ready.
+
+    Arguments
+    ---------
+    func                  : module level function taking the zone as its first argument
+    deps                  : dict of each zone mapped to the zones it waits on, see `zoneDependencies`
+    args                  : further arguments passed to `func`
+    n_jobs                : number of worker processes, defaults to the number of CPUs
+    zone_kwargs           : function of the zone returning keyword arguments for `func`, called
+                            when the zone is submitted so it can use results of the zones before it
+
+    Yields
+    ---------
+    tuple
+        each zone and the value `func` returned for it, as they finish
+    """
+    waiting = {zone: set(d) for zone, d in deps.items()}
+    n_jobs = n_jobs or min(len(deps), os.cpu_count()) or 1
+    # split the CPUs between the workers so the numba kernel doesn't oversubscribe them
+    threads = max(1, (os.cpu_count() or 1) // n_jobs)
+    # loky workers don't re-import the calling script, unlike multiprocessing spawn
+    executor = get_reusable_executor(max_workers=n_jobs)
+    running = {}
+    while waiting or running:
+        for zone in [z for z, d in waiting.items() if not d]:
+            del waiting[zone]
+            kwargs = zone_kwargs(zone) if zone_kwargs else {}
+            running[
+                executor.submit(_run_zone, threads, func, zone, *args, **kwargs)
+            ] = zone
+        if not running:
+            raise ValueError(f"Cyclic zone dependencies: {sorted(waiting)}")
+        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in finished:
+            zone = running.pop(future)
+            result = future.result()  # re-raise errors from the worker
+            for d in waiting.values():
+                d.discard(zone)
+            yield zone, result
+
+
+##############################################################################
+
+
 def swapper(coms, upStream):
     """
     __author__ =  "Marc Weber <weber.marc@epa.gov>"
@@ -1305,6 +3469,89 @@ def make_all_cat_comids(nhd, inputs):
     all_comids = np.concatenate(results)
     return set(all_comids.flatten())
 
+def upstream_index(comids, tree, chkset):
+    """
+    Builds the upstream arrays for every COMID in `comids` with a single walk
+    of the flow network. Strongly connected components are found with an
+    iterative Tarjan search, which emits them headwaters first, so the full
+    upstream set of each component is merged from the already finished sets
+    of the components draining into it. Unbranched reaches reuse their
+    upstream neighbor's array with one append, only confluences and
+    divergences are de-duplicated. Returns the same values as calling
+    `bastards` for each COMID and intersecting the result with `chkset`.
+
+    Arguments
+    ---------
+    comids          : numpy array of the COMIDs to return upstream arrays for
+    tree            : Full dictionary of list of upstream COMIDs for each COMID in the zone
+    chkset          : set of all the NHD catchment COMIDs, used to remove flowlines with no associated catchment
+
+    Returns
+    ---------
+    tuple
+        numpy array of upstream lengths for each COMID and numpy array of
+        all upstream COMIDs concatenated in the order of `comids`
+    """
+    index, low = {}, {}
+    stack, on_stack = [], set()
+    full = {}  # every catchment COMID reachable from a node, itself included
+    counter = 0
+    for root in comids:
+        if root in index:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(tree.get(root, ())))]
+        while work:
+            node, ups = work[-1]
+            for up in ups:
+                if up not in index:
+                    index[up] = low[up] = counter
+                    counter += 1
+                    stack.append(up)
+                    on_stack.add(up)
+                    work.append((up, iter(tree.get(up, ()))))
+                    break
+                if up in on_stack:
+                    low[node] = min(low[node], index[up])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] != index[node]:
+                    continue
+                members = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    members.append(member)
+                    if member == node:
+                        break
+                in_scc = set(members)
+                feeders = {
+                    up for m in members for up in tree.get(m, ()) if up not in in_scc
+                }
+                parts = [full[up] for up in feeders]
+                own = np.array([m for m in members if m in chkset], dtype=np.int64)
+                if len(parts) == 1 and len(members) == 1:
+                    reach = np.append(parts[0], own) if own.size else parts[0]
+                elif parts:
+                    reach = np.unique(np.concatenate(parts + [own]))
+                else:
+                    reach = own
+                for member in members:
+                    full[member] = reach
+    ups = []
+    for com in comids:
+        reach = full[com]
+        ups.append(reach[reach != com])
+    lengths = np.array([len(u) for u in ups])
+    upstream = np.concatenate(ups).astype(np.int32) if ups else np.array([], np.int32)
+    return lengths, upstream
+
 def processZone(zone, hr, nhd, inter_tbl, all_comids):
     pre = f"{nhd}/NHDPlus{hr}/NHDPlus{zone}"
     flow = pyogrio.read_dataframe(f"{pre}/NHDPlusAttributes/PlusFlow.dbf", columns=["TOCOMID", "FROMCOMID"], read_geometry=False, use_arrow=True)
@@ -1320,8 +3567,8 @@ def processZone(zone, hr, nhd, inter_tbl, all_comids):
     flow = flow[~flow.FROMCOMID.isin(np.setdiff1d(out, inter_tbl.thruCOMIDs.values))]
     
     flow_dict = defaultdict(list)
-    for _, row in flow.iterrows():
-        flow_dict[row.TOCOMID].append(row.FROMCOMID)
+    for tocomid, fromcomid in zip(flow.TOCOMID.values, flow.FROMCOMID.values):
+        flow_dict[tocomid].append(fromcomid)
     
     for interLine in inter_tbl.values:
         if interLine[6] > 0 and interLine[2] == zone:
@@ -1336,16 +3583,208 @@ def processZone(zone, hr, nhd, inter_tbl, all_comids):
     comids = cats.index.values
     comids = np.append(comids, out_of_vpus)
     
-    ups = [list(all_comids.intersection(bastards(x, flow_dict))) for x in comids]
-    lengths = np.array([len(u) for u in ups])
-    upstream = np.hstack(ups).astype(np.int32)
-    
-    assert len(ups) == len(lengths) == len(comids)
-    np.savez_compressed(
-        f"./accum_npy/accum_{zone}.npz",
-        comids=comids,
-        lengths=lengths,
-        upstream=upstream,
+    lengths, upstream = upstream_index(comids, flow_dict, all_comids)
+
+    assert len(lengths) == len(comids)
+    offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+    save_accum(zone, comids, offsets, upstream)
+
+
+def save_accum(zone, comids, offsets, upstream, accum_dir="accum_npy"):
+    """
+    Writes the upstream topology of a zone as uncompressed .npy arrays in
+    `accum_dir/accum_{zone}/` so that readers can memory-map them with
+    `load_accum` instead of decompressing an npz archive.
+
+    Arguments
+    ---------
+    zone            : string of an NHDPlusV2 VPU zone, i.e. 10L, 16, 17
+    comids          : numpy array of all COMIDs in the zone
+    offsets         : numpy array of start positions in `upstream` for each COMID, len(comids) + 1 long
+    upstream        : numpy array of all upstream COMIDs concatenated in the order of `comids`
+    accum_dir       : directory where the topology is stored
+    """
+    out_dir = f"{accum_dir}/accum_{zone}"
+    os.makedirs(out_dir, exist_ok=True)
+    for name, arr in (
+        ("comids", comids),
+        ("offsets", np.asarray(offsets, dtype=np.int64)),
+        ("upstream", np.asarray(upstream, dtype=np.int32)),
+    ):
+        # write next to the target and swap in so readers never map a partial file
+        tmp = f"{out_dir}/{name}.tmp.npy"
+        np.save(tmp, np.ascontiguousarray(arr))
+        os.replace(tmp, f"{out_dir}/{name}.npy")
+    # a cached upstream matrix belongs to the old topology, rebuilt on demand
+    if os.path.exists(f"{out_dir}/matrix.npz"):
+        os.remove(f"{out_dir}/matrix.npz")
+
+
+def load_accum(zone, accum_dir="accum_npy", mmap_mode="r"):
+    """
+    Opens the upstream topology of a zone written by `save_accum`. Arrays are
+    memory-mapped read-only, so several processes reading the same zone share
+    pages through the OS cache. Falls back to the older
+    `accum_{zone}.npz` archives, converting their `lengths` to `offsets`.
+
+    Arguments
+    ---------
+    zone            : string of an NHDPlusV2 VPU zone, i.e. 10L, 16, 17
+    accum_dir       : directory where the topology is stored
+    mmap_mode       : mode passed to np.load, None reads the arrays into memory
+
+    Returns
+    ---------
+    dict
+        `comids`, `offsets` and `upstream` arrays for the zone
+    """
+    zone_dir = f"{accum_dir}/accum_{zone}"
+    if os.path.exists(f"{zone_dir}/offsets.npy"):
+        return {
+            name: np.load(f"{zone_dir}/{name}.npy", mmap_mode=mmap_mode)
+            for name in ("comids", "offsets", "upstream")
+        }
+    accum = np.load(f"{accum_dir}/accum_{zone}.npz")
+    return {
+        "comids": accum["comids"],
+        "offsets": np.concatenate(([0], np.cumsum(accum["lengths"], dtype=np.int64))),
+        "upstream": accum["upstream"],
+    }
+
+
+def save_zone_runs(zone, zone_raster, accum_dir="accum_npy", block_size=256):
+    """
+    Converts the catchment grid of a zone into the row-wise run-length index
+    read by `ZoneRuns`, stored as uncompressed .npy arrays in
+    `accum_dir/zones_{zone}/` next to the upstream topology.
+
+    Arguments
+    ---------
+    zone            : string of an NHDPlusV2 VPU zone, i.e. 10L, 16, 17
+    zone_raster     : string to the NHD catchment grid
+    accum_dir       : directory where the topology is stored
+    block_size      : rows of the zone grid read at a time
+    """
+    runs = defaultdict(list)
+    with rasterio.open(zone_raster) as src:
+        for r0 in range(0, src.height, block_size):
+            window = Window(0, r0, src.width, min(block_size, src.height - r0))
+            zones = src.read(1, window=window).astype(np.int32)
+            zones[~(valid_cells(zones, src.nodata) & (zones >= 0))] = ZoneRuns.nodata
+            flat = zones.ravel()
+            # a run starts where the code changes and at the start of each row
+            brk = np.empty(flat.size, dtype=bool)
+            brk[0] = True
+            brk[1:] = flat[1:] != flat[:-1]
+            brk[:: src.width] = True
+            starts = np.flatnonzero(brk)
+            ends = np.append(starts[1:], flat.size)
+            keep = flat[starts] != ZoneRuns.nodata
+            starts, ends = starts[keep], ends[keep]
+            row, col = np.divmod(starts, src.width)
+            runs["row"].append((row + r0).astype(np.int32))
+            runs["col_start"].append(col.astype(np.int32))
+            runs["col_end"].append((col + ends - starts).astype(np.int32))
+            runs["gridcode"].append(flat[starts])
+        grid = {
+            "transform": np.array(src.transform[:6]),
+            "shape": np.array([src.height, src.width]),
+            "crs": np.array(src.crs.to_wkt() if src.crs else ""),
+            "fingerprint": np.array(file_fingerprint(zone_raster)),
+        }
+    out_dir = f"{accum_dir}/zones_{zone}"
+    os.makedirs(out_dir, exist_ok=True)
+    for name, arr in runs.items():
+        tmp = f"{out_dir}/{name}.tmp.npy"
+        np.save(tmp, np.concatenate(arr))
+        os.replace(tmp, f"{out_dir}/{name}.npy")
+    # written last, a zone without grid.npz has no complete index
+    np.savez(f"{out_dir}/grid.tmp.npz", **grid)
+    os.replace(f"{out_dir}/grid.tmp.npz", f"{out_dir}/grid.npz")
+
+
+def load_zone_runs(zone, zone_raster, accum_dir="accum_npy", mmap_mode="r"):
+    """
+    Opens the run-length index of a zone's catchment grid, building it with
+    `save_zone_runs` when it is missing or the grid has changed since. The
+    runs are memory-mapped read-only.
+
+    Arguments
+    ---------
+    zone            : string of an NHDPlusV2 VPU zone, i.e. 10L, 16, 17
+    zone_raster     : string to the NHD catchment grid
+    accum_dir       : directory where the topology is stored
+    mmap_mode       : mode passed to np.load, None reads the arrays into memory
+
+    Returns
+    ---------
+    ZoneRuns
+    """
+    zone_dir = f"{accum_dir}/zones_{zone}"
+    fresh = False
+    if os.path.exists(f"{zone_dir}/grid.npz"):
+        with np.load(f"{zone_dir}/grid.npz") as grid:
+            # indexes written before the crs was stored are rebuilt
+            fresh = "crs" in grid.files and tuple(
+                grid["fingerprint"]
+            ) == file_fingerprint(zone_raster)
+    if not fresh:
+        save_zone_runs(zone, zone_raster, accum_dir)
+    with np.load(f"{zone_dir}/grid.npz") as grid:
+        affine = transform.Affine(*grid["transform"])
+        shape = tuple(int(x) for x in grid["shape"])
+        wkt = str(grid["crs"])
+    return ZoneRuns(
+        *(
+            np.load(f"{zone_dir}/{name}.npy", mmap_mode=mmap_mode)
+            for name in ("row", "col_start", "col_end", "gridcode")
+        ),
+        affine,
+        shape,
+        zone_raster,
+        rasterio.crs.CRS.from_wkt(wkt) if wkt else None,
+    )
+
+
+def save_upstream_matrix(zone, comids, offsets, upstream, accum_dir="accum_npy"):
+    """
+    Writes the upstream incidence matrix of a zone next to its topology
+    arrays as `accum_dir/accum_{zone}/matrix.npz` for the 'sparse'
+    Accumulation engine.
+
+    Arguments
+    ---------
+    zone            : string of an NHDPlusV2 VPU zone, i.e. 10L, 16, 17
+    comids          : numpy array of all COMIDs in the zone
+    offsets         : numpy array of start positions in `upstream` for each COMID, len(comids) + 1 long
+    upstream        : numpy array of all upstream COMIDs concatenated in the order of `comids`
+    accum_dir       : directory where the topology is stored
+    """
+    matrix = upstream_matrix(len(comids), swapper(comids, upstream), offsets)
+    out_dir = f"{accum_dir}/accum_{zone}"
+    os.makedirs(out_dir, exist_ok=True)
+    tmp = f"{out_dir}/matrix.tmp.npz"
+    sparse.save_npz(tmp, matrix, compressed=False)
+    os.replace(tmp, f"{out_dir}/matrix.npz")
+    return matrix
+
+
+def load_upstream_matrix(zone, accum_dir="accum_npy"):
+    """
+    Reads the upstream incidence matrix of a zone, building and caching it
+    from the topology arrays when it doesn't exist yet.
+
+    Arguments
+    ---------
+    zone            : string of an NHDPlusV2 VPU zone, i.e. 10L, 16, 17
+    accum_dir       : directory where the topology is stored
+    """
+    path = f"{accum_dir}/accum_{zone}/matrix.npz"
+    if os.path.exists(path):
+        return sparse.load_npz(path)
+    accum = load_accum(zone, accum_dir)
+    return save_upstream_matrix(
+        zone, accum["comids"], accum["offsets"], accum["upstream"], accum_dir
     )
 
 def makeNumpyVectors(inter_tbl, nhd, user_zones):
@@ -1441,14 +3880,10 @@ def findUpstreamNpy(zone, com, numpy_dir):
     com                   : COMID of NHD Catchment, integer
     numpy_dir             : directory where .npy files are stored
     """
-    accum = np.load(numpy_dir + "/accum_" + zone + ".npz")
-    comids = accum["comids"]
-    lengths = accum["lengths"]
-    upStream = accum["upstream"]
-    itemindex = int(np.where(comids == com)[0])
-    n = lengths[:itemindex].sum()
-    arrlen = lengths[itemindex]
-    return upStream[n : n + arrlen]
+    accum = load_accum(zone, numpy_dir)
+    itemindex = int(np.flatnonzero(accum["comids"] == com)[0])
+    start, stop = accum["offsets"][itemindex : itemindex + 2]
+    return np.array(accum["upstream"][start:stop])
 
 
 def dbf2DF(f, upper=True):